@@ -0,0 +1,148 @@
+# benchmark-helpers.py
+
+# microbenchmarks of the per-record helper functions in callmito_single
+# save a baseline with --save, then check for regressions with --compare
+
+
+import callmito_single
+import sys
+import argparse
+import json
+import platform
+import random
+import timeit
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='benchmark-helpers.py')
+
+parser.add_argument('--save', type=str,help='write results to this baseline json file')
+parser.add_argument('--compare', type=str,help='compare results to this baseline json file')
+parser.add_argument('--threshold', type=float,help='flag a regression when throughput drops by more than this fraction',default=0.10)
+parser.add_argument('--repeat', type=int,help='number of timing repeats, the best is kept',default=5)
+parser.add_argument('--minTime', type=float,help='seconds per timing repeat',default=0.2)
+
+
+args = parser.parse_args()
+
+#####################################################################
+# fixture records, made with a fixed seed so every run times the same data
+
+random.seed(1983)
+refSeq = callmito_single.read_fasta_seq(sys.path[0] + '/refs/NC_002008.4.fa')
+
+def make_read(pos,cigar,flag):
+    readLen = 0
+    for c in callmito_single.expand_cigar(cigar):
+        if c[1] in 'MIS=X':
+            readLen += c[0]
+    seq = refSeq[pos-1:pos-1+readLen]
+    seq = ''.join([b if random.random() > 0.01 else 'ACGT'[random.randint(0,3)] for b in seq])
+    qual = ''.join([chr(33+random.randint(20,41)) for i in range(readLen)])
+    name = 'A00123:45:HABCDEFXX:1:%i:%i:%i' % (random.randint(1101,2678),random.randint(1000,32000),random.randint(1000,37000))
+    tags = ['XT:A:U','NM:i:2','X0:i:1','X1:i:0','XM:i:1','XO:i:1','XG:i:1','MD:Z:25^A49T20','RG:Z:norm']
+    return [name,str(flag),'NC_002008.4',str(pos),'37',cigar,'*','0','0',seq,qual] + tags
+
+samLines = [make_read(1200,'100M',0),
+            make_read(2500,'100M',16),
+            make_read(4100,'3S25M2I30M1D40M2S',16),
+            make_read(7300,'12S18M1I7M3D22M1I15M5S',0),
+            make_read(9900,'5H30M4I10M2D33M',16)]
+
+infoFields = ['AS_FilterStatus=SITE|strand_bias,weak_evidence;AS_SB_TABLE=12,15|233,241|0,9;DP=512;ECNT=3;GERMQ=93;MBQ=37,37,37;MFRL=0,0,0;MMQ=37,37,37;MPOS=41,38;POPAF=7.30;TLOD=1523.66,12.41',
+              'AS_FilterStatus=SITE;AS_SB_TABLE=0,0|88,95;DP=186;ECNT=1;GERMQ=93;MBQ=0,37;MFRL=0,0;MMQ=37,37;MPOS=45;POPAF=7.30;TLOD=612.40']
+genotypes = [['GT:AD:AF:DP:F1R2:F2R1:SB','0/1/2:27,474,9:0.925,0.018:510:0,0,0:0,0,0:12,15,233,250'],
+             ['GT:AD:AF:DP:F1R2:F2R1:SB','0/1:0,183:0.995:183:0,0:0,0:0,0,88,95']]
+vcfLines = ['NC_002008.4\t2683\t.\tG\tA,GA\t.\tPASS\t%s\t%s\t%s\n' % (infoFields[0],genotypes[0][0],genotypes[0][1]),
+            'NC_002008.4\t8807\t.\tG\tA\t.\tPASS\t%s\t%s\t%s\n' % (infoFields[1],genotypes[1][0],genotypes[1][1])]
+
+samRecs = [callmito_single.parse_sam_line(l) for l in samLines]
+cigars = [l[5] for l in samLines]
+seqs = [l[9] for l in samLines]
+
+#####################################################################
+# benchmarks, each does one call per fixture record
+
+def bench_parse_sam_line():
+    for l in samLines:
+        callmito_single.parse_sam_line(l)
+
+def bench_expand_cigar():
+    for c in cigars:
+        callmito_single.expand_cigar(c)
+
+def bench_complement():
+    for s in seqs:
+        for c in s:
+            callmito_single.complement(c)
+
+def bench_revcomp():
+    for s in seqs:
+        callmito_single.revcomp(s)
+
+def bench_get_seq_from_sam():
+    for r in samRecs:
+        callmito_single.get_seq_from_sam(r)
+
+def bench_parse_vcf_info():
+    for i in infoFields:
+        callmito_single.parse_vcf_info(i)
+
+def bench_parse_genotype():
+    for g in genotypes:
+        callmito_single.parse_genotype(g[0],g[1])
+
+def bench_vcf_record():
+    for l in vcfLines:
+        rec = callmito_single.VCFRecord(l)
+        rec.info('AS_FilterStatus')
+        rec.format_value('AD')
+
+# name, function, records handled per call
+benchmarks = [['parse_sam_line',bench_parse_sam_line,len(samLines)],
+              ['expand_cigar',bench_expand_cigar,len(cigars)],
+              ['complement',bench_complement,sum([len(s) for s in seqs])],
+              ['revcomp',bench_revcomp,len(seqs)],
+              ['get_seq_from_sam',bench_get_seq_from_sam,len(samRecs)],
+              ['parse_vcf_info',bench_parse_vcf_info,len(infoFields)],
+              ['parse_genotype',bench_parse_genotype,len(genotypes)],
+              ['VCFRecord',bench_vcf_record,len(vcfLines)]]
+
+#####################################################################
+
+results = {}
+for b in benchmarks:
+    timer = timeit.Timer(b[1])
+    n,t = timer.autorange()
+    n = max(1,int(n * args.minTime / max(t,1e-9)))
+    best = min(timer.repeat(repeat=args.repeat,number=n))
+    results[b[0]] = n * b[2] / best
+    print('%s\t%.0f records/sec' % (b[0],results[b[0]]),flush=True)
+
+if args.save is not None:
+    outFile = open(args.save,'w')
+    json.dump({'python':platform.python_version(),'host':platform.node(),'results':results},outFile,indent=1)
+    outFile.write('\n')
+    outFile.close()
+    print('saved baseline to %s' % args.save)
+
+if args.compare is not None:
+    inFile = open(args.compare,'r')
+    baseline = json.load(inFile)
+    inFile.close()
+    print('\nname\tbaseline\tcurrent\tchange')
+    regressions = []
+    for name in results:
+        if name not in baseline['results']:
+            print('%s\t.\t%.0f\tnew' % (name,results[name]))
+            continue
+        change = results[name] / baseline['results'][name] - 1.0
+        flag = ''
+        if change < -args.threshold:
+            flag = '\tREGRESSION'
+            regressions.append(name)
+        print('%s\t%.0f\t%.0f\t%+.1f%%%s' % (name,baseline['results'][name],results[name],100*change,flag))
+    if len(regressions) > 0:
+        print('ERROR! %i benchmarks more than %.0f%% slower than baseline: %s' % (len(regressions),100*args.threshold,','.join(regressions)))
+        sys.exit(1)
+    print('no regressions over %.0f%%' % (100*args.threshold))
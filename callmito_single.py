@@ -9,8 +9,25 @@ import time
 import socket
 import shutil
 import gzip
+import hashlib
+import json
+import concurrent.futures
+import cProfile
+import pstats
+import tracemalloc
+import threading
+import io
+import array
+import traceback
+import multiprocessing
+import sqlite3
+import fcntl
 import numpy as np
 
+###############################################################################
+# raised instead of exiting so one failed sample does not stop the interpreter
+class CallmitoError(Exception):
+    pass
 ###############################################################################
 # Helper function to run commands, handle return values and print to log file
 def runCMD(cmd):
@@ -18,9 +35,7 @@ def runCMD(cmd):
     if val == 0:
         pass
     else:
-        print('command failed')
-        print(cmd)
-        sys.exit(1)
+        raise CallmitoError('command failed: %s' % cmd)
 ###############################################################################
 # Helper function to run commands, handle return values and print to log file
 def runCMD_output(cmd):
@@ -30,49 +45,329 @@ def runCMD_output(cmd):
        i = i.rstrip()
        resLines.append(i)
     return resLines
-#############################################################################        
-# setup paths to default programs to use and checks for required programs
-def check_prog_paths(myData):        
-    myData['logFile'].write('\nChecking for required programs...\n')
-    
-    for p in ['bwa','gatk','samtools','liftOver','bgzip','tabix','bcftools']:
-        if shutil.which(p) is None:
-            s = p + ' not found in path! please fix (module load?)'
-            print(s, flush=True)
-            myData['logFile'].write(s + '\n')
-            myData['logFile'].close()        
-            sys.exit()
-        else:
-            myData['logFile'].write('%s\t%s\n' % (p,shutil.which(p)))
-            
-
-    check_gatk_version(myData)
-
-    myData['logFile'].flush()              
-
-
-############################################################################# 
-def check_gatk_version(myData):
-    myData['tmpVersionName'] = myData['finalDirSample'] + 'tmp.gatk.version'
-
-    gatk_v = runCMD_output('gatk --version > %s' % myData['tmpVersionName'])
-    inFile = open(myData['tmpVersionName'],'r')    
-    line = inFile.readline()
-    inFile.close()
-    line = line.rstrip()
-    line = line.split()
-    v = line[-1]
-        
-    s = 'GATK version is: %s' % v
+###############################################################################
+# Helper function to run commands in parallel, at most maxProcs at a time
+def runCMD_parallel(cmds,maxProcs):
+    active = []
+    failed = []
+    for cmd in cmds:
+        while len(active) >= maxProcs:
+            for a in active:
+                if a[1].poll() is not None:
+                    active.remove(a)
+                    if a[1].returncode != 0:
+                        failed.append(a[0])
+                    break
+            else:
+                time.sleep(0.5)
+        active.append([cmd,subprocess.Popen(cmd, shell=True)])
+    for a in active:
+        if a[1].wait() != 0:
+            failed.append(a[0])
+    if len(failed) > 0:
+        raise CallmitoError('command failed: %s' % '\n'.join(failed))
+###############################################################################
+# compression levels for transient intermediates, final outputs use tool defaults
+def set_compression_policy(myData):
+    if myData['compressionPolicy'] == 'none':
+        myData['tmpCompressLevel'] = 0
+    elif myData['compressionPolicy'] == 'fast':
+        myData['tmpCompressLevel'] = 1
+    else:
+        myData['tmpCompressLevel'] = None
+###############################################################################
+# compression options for a tool, tool is one of samtools, bgzip, picard or gatk
+# gatk engine tools such as Mutect2 take the level from the samjdk java property
+def compress_opts(myData,tool,final=False):
+    opts = ''
+    level = myData['tmpCompressLevel']
+    if final is True:
+        level = None
+    if tool in ['samtools','bgzip']:
+        opts += ' -@ %i' % myData['compressThreads']
+        if level is not None:
+            opts += ' -l %i' % level
+    elif tool == 'picard':
+        if level is not None:
+            opts += ' --COMPRESSION_LEVEL %i' % level
+    elif tool == 'gatk':
+        if level is not None:
+            opts += ' --java-options "-Dsamjdk.compression_level=%i"' % level
+    return opts
+###############################################################################
+# open a multithreaded bgzip writer, write text to the returned process stdin
+def open_bgzip_writer(myData,fileName,final=False):
+    cmd = 'bgzip -c%s > %s' % (compress_opts(myData,'bgzip',final),fileName)
+    proc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdin = subprocess.PIPE)
+    return proc
+###############################################################################
+def close_bgzip_writer(proc):
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise CallmitoError('command failed: %s' % proc.args)
+###############################################################################
+# with --retention clean, remove intermediate files once the steps that read them
+# are done, along with their indexes and the stats files gatk writes next to them
+def remove_intermediates(myData,fileNames):
+    if myData.get('retention','keep') != 'clean':
+        return
+    toRemove = []
+    for f in fileNames:
+        for ext in ['','.bai','.tbi','.stats','.filteringStats.tsv']:
+            if os.path.isfile(f + ext):
+                toRemove.append(f + ext)
+    if len(toRemove) == 0:
+        return
+    cmd = 'rm ' + ' '.join(toRemove)
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    runCMD(cmd)
+#############################################################################
+# programs the pipeline runs and the index files needed next to each reference
+requiredProgs = ['bwa','gatk','samtools','liftOver','bgzip','tabix','bcftools']
+bwaIndexExts = ['.amb','.ann','.bwt','.pac','.sa']
+#############################################################################
+# check programs and all input and index files in parallel before any work is done
+# results of the gatk version probe are cached by binary path, mtime and size
+def preflight_checks(myData):
+    myData['logFile'].write('\nRunning preflight checks...\n')
+    t = time.time()
+    cache = read_preflight_cache(myData['preflightCache'])
+
+    checks = []
+    for p in requiredProgs:
+        checks.append([check_prog_path,p])
+    checks.append([check_gatk_version,cache])
+    for fa in [myData['mitoFa'],myData['mitoFaRotated']]:
+        checks.append([check_file,fa,'mito fasta'])
+        checks.append([check_file,fa + '.fai','fasta index, please run samtools faidx'])
+        checks.append([check_file,fa.replace('.fa','.dict'),'sequence dictionary, please run gatk CreateSequenceDictionary'])
+        for ext in bwaIndexExts:
+            checks.append([check_file,fa + ext,'bwa index, please run bwa index'])
+    checks.append([check_file,myData['mitoFaIntervalList'],'interval list, please make interval list'])
+    checks.append([check_file,myData['mitoFaRotatedIntervalList'],'interval list, please make interval list'])
+    checks.append([check_file,myData['ref'] + '.fai','fasta index, please run samtools faidx'])
+    checks.append([check_file,myData['chainFile'],'chain file'])
+    checks.append([check_file,myData['diagnosticTable'],'diagnostic table'])
+    checks.append([check_file,myData['coordsFileName'],'coordinates to extract'])
+    for lib in myData['libraries']:
+        checks.append([check_aln_index,lib['cram']])
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    results = list(pool.map(lambda c: c[0](*c[1:]),checks))
+    pool.shutdown()
+    write_preflight_cache(myData['preflightCache'],cache)
+
+    errors = []
+    for r in results:
+        myData['logFile'].write(r[1] + '\n')
+        if r[0] is False:
+            errors.append(r[1])
+    s = 'preflight checks took %.2f seconds' % (time.time() - t)
     print(s,flush=True)
     myData['logFile'].write(s + '\n')
-
+    if len(errors) > 0:
+        raise CallmitoError('preflight checks failed:\n' + '\n'.join(errors))
+    myData['logFile'].flush()
+#############################################################################
+def check_prog_path(p):
+    if shutil.which(p) is None:
+        return [False,p + ' not found in path! please fix (module load?)']
+    return [True,'%s\t%s' % (p,shutil.which(p))]
+#############################################################################
+def check_file(fileName,desc):
+    if os.path.isfile(fileName) is False:
+        return [False,'ERROR! %s not found (%s)' % (fileName,desc)]
+    return [True,'found %s' % fileName]
+#############################################################################
+# extraction of regions from the bam/cram needs an index
+def check_aln_index(alnFileName):
+    if os.path.isfile(alnFileName) is False:
+        return [False,'ERROR! %s not found' % alnFileName]
+    for idx in [alnFileName + '.crai',alnFileName + '.bai',alnFileName[:-4] + '.bai',alnFileName + '.csi']:
+        if os.path.isfile(idx) is True:
+            return [True,'found %s' % idx]
+    return [False,'ERROR! no index found for %s, please run samtools index' % alnFileName]
+#############################################################################
+def check_gatk_version(cache):
+    gatkPath = shutil.which('gatk')
+    if gatkPath is None:
+        return [False,'gatk not found in path! please fix (module load?)']
+    key = prog_cache_key(gatkPath)
+    if key in cache:
+        v = cache[key]
+        s = 'GATK version is: %s (cached)' % v
+    else:
+        # only a version from a successful probe is cached, a failed probe is retried next run
+        proc = subprocess.run('gatk --version', universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+        v = 'unknown'
+        for line in proc.stdout.split('\n'):
+            line = line.split()
+            if len(line) > 0 and line[-1][0] == 'v' and line[-1][1:2].isdigit():
+                v = line[-1]
+                break
+        if proc.returncode == 0 and v != 'unknown':
+            cache[key] = v
+        s = 'GATK version is: %s' % v
+    print(s,flush=True)
     if v != 'v4.2.5.0':
-        s = 'ERROR! GATK v4.2.5.0 is required!.  Please fix'
-        print(s, flush=True)
-        myData['logFile'].write(s + '\n')
-        myData['logFile'].close()        
-        sys.exit()
+        return [False,'ERROR! GATK v4.2.5.0 is required!.  Please fix (found %s)' % v]
+    return [True,s]
+#############################################################################
+# cache key for a program, changes when the binary (or the gatk jar) changes
+def prog_cache_key(progPath):
+    progPath = os.path.realpath(progPath)
+    st = os.stat(progPath)
+    key = '%s:%i:%i' % (progPath,st.st_mtime,st.st_size)
+    if 'GATK_LOCAL_JAR' in os.environ:
+        key += ':' + os.environ['GATK_LOCAL_JAR']
+    return key
+#############################################################################
+def read_preflight_cache(cacheFileName):
+    if os.path.isfile(cacheFileName) is False:
+        return {}
+    try:
+        inFile = open(cacheFileName,'r')
+        cache = json.load(inFile)
+        inFile.close()
+    except (OSError,ValueError):
+        return {}
+    return cache
+#############################################################################
+# write through a temp name, many samples may share the cache
+def write_preflight_cache(cacheFileName,cache):
+    try:
+        os.makedirs(os.path.dirname(cacheFileName),exist_ok=True)
+        # unique per process and thread, samples of one interpreter may write at once
+        tmpName = '%s.%i.%i.tmp' % (cacheFileName,os.getpid(),threading.get_ident())
+        outFile = open(tmpName,'w')
+        json.dump(cache,outFile,indent=1)
+        outFile.close()
+        os.replace(tmpName,cacheFileName)
+    except OSError:
+        print('could not write preflight cache %s' % cacheFileName,flush=True)
+#############################################################################
+# run one stage of the pipeline, recording its time in the stage times file
+# with --profile the stage is also run under cProfile and tracemalloc
+def run_stage(myData,stageName,stageFunc):
+    myData['currentStage'] = stageName
+    t = time.time()
+    if myData['profile'] is True:
+        ret = profile_stage(myData,stageName,stageFunc)
+    else:
+        ret = stageFunc(myData)
+    t = time.time() - t
+
+    if 'stageTimes' not in myData:
+        myData['stageTimes'] = []
+    myData['stageTimes'].append([stageName,t])
+    myData['stageTimesFile'] = myData['finalDirSample'] + myData['sampleName'] + '.stage-times.txt'
+    outFile = open(myData['stageTimesFile'],'w')
+    outFile.write('#stage\tseconds\n')
+    for st in myData['stageTimes']:
+        outFile.write('%s\t%.2f\n' % (st[0],st[1]))
+    outFile.close()
+    return ret
+#############################################################################
+# snapshot of allocations whenever traced memory grows past the last snapshot,
+# so structures freed by the end of a stage still show up in the report
+def watch_memory_peak(peakSnap,stopEvent):
+    while stopEvent.wait(0.5) is False:
+        current = tracemalloc.get_traced_memory()[0]
+        if current > 1.1 * peakSnap['size'] and current > 1e6:
+            peakSnap['snapshot'] = tracemalloc.take_snapshot()
+            peakSnap['size'] = current
+#############################################################################
+def profile_stage(myData,stageName,stageFunc):
+    reportName = myData['finalDirSample'] + 'profile.%s.txt' % stageName
+    statsName = myData['finalDirSample'] + 'profile.%s.prof' % stageName
+
+    peakSnap = {'snapshot':None,'size':0}
+    stopEvent = threading.Event()
+    watcher = threading.Thread(target=watch_memory_peak,args=(peakSnap,stopEvent),daemon=True)
+    tracemalloc.start()
+    watcher.start()
+    prof = cProfile.Profile()
+    myData['workerProfiles'] = []
+    t = time.time()
+    prof.enable()
+    try:
+        ret = stageFunc(myData)
+    finally:
+        prof.disable()
+        t = time.time() - t
+        stopEvent.set()
+        watcher.join()
+        endSnap = tracemalloc.take_snapshot()
+        current,peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # add the profiles of the stage's worker threads
+        statsText = io.StringIO()
+        stats = pstats.Stats(prof,stream=statsText)
+        for workerProf in myData['workerProfiles']:
+            stats.add(workerProf)
+        myData['workerProfiles'] = []
+        stats.dump_stats(statsName)
+        if 'profileFiles' not in myData:
+            myData['profileFiles'] = []
+        myData['profileFiles'] += [reportName,statsName]
+        outFile = open(reportName,'w')
+        outFile.write('stage\t%s\n' % stageName)
+        outFile.write('seconds\t%.2f\n' % t)
+        outFile.write('peakPythonMB\t%.1f\n' % (peak/1e6))
+        outFile.write('endPythonMB\t%.1f\n' % (current/1e6))
+        if peakSnap['snapshot'] is not None:
+            outFile.write('\n#top allocation sites near peak (%.1f MB traced)\n' % (peakSnap['size']/1e6))
+            for stat in peakSnap['snapshot'].statistics('lineno')[:20]:
+                outFile.write('%s\n' % stat)
+        outFile.write('\n#top allocation sites at end of stage\n')
+        for stat in endSnap.statistics('lineno')[:20]:
+            outFile.write('%s\n' % stat)
+        outFile.write('\n#cpu profile, by cumulative time, with worker threads\n')
+        stats.sort_stats('cumulative').print_stats(30)
+        outFile.write(statsText.getvalue())
+        outFile.close()
+        s = 'stage %s: %.2f seconds, peak python memory %.1f MB, profile in %s' % (stageName,t,peak/1e6,reportName)
+        print(s,flush=True)
+    return ret
+#############################################################################
+# cProfile only sees the thread it was enabled in, so with --profile each worker
+# thread profiles its own call and profile_stage adds them to the stage report
+def profiled_call(myData,func,*args):
+    if myData['profile'] is False:
+        return func(*args)
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        return func(*args)
+    finally:
+        prof.disable()
+        myData['workerProfiles'].append(prof)
+#############################################################################
+# myData keys of the files that are kept, with their indexes
+finalOutputKeys = ['mitoBamSortMD','mitoRotatedBamSortMD','mitoBamDupMet','mitoRotatedDupMet',
+                   'mitoHSmets','mitoRotatedHSmets','mitoMergePerBp','mitoMergePerBpStats',
+                   'mitoMergeVCF','mitoMergeVCFFilter','mitoMergeNonRefFraction','mitoMergeMasked',
+                   'mitoMergeFasta','mitoMergeHaploGroup','alleleStore','callerBenchmark','stageTimesFile',
+                   'collapseMetrics','collapseDupMetrics','qcFail','logFileName']
+#############################################################################
+# copy final outputs from the scratch dir to the output dir, each file is copied
+# to a temp name and renamed so a partial copy is never seen
+def stage_out(myData,outputKeys=finalOutputKeys):
+    outFiles = [myData[k] for k in outputKeys if k in myData]
+    outFiles += myData.get('profileFiles',[])
+    for f in outFiles:
+        for ext in ['','.bai','.tbi','.crai']:
+            src = f + ext
+            if os.path.isfile(src) is False:
+                continue
+            dest = myData['outDirSample'] + os.path.basename(src)
+            print('copy %s to %s' % (src,dest),flush=True)
+            shutil.copyfile(src,dest + '.tmp')
+            os.replace(dest + '.tmp',dest)
+    print('removing scratch dir %s' % myData['finalDirSample'],flush=True)
+    shutil.rmtree(myData['finalDirSample'])
 ############################################################################# 
 def init_log(myData):
     k = list(myData.keys())
@@ -88,10 +383,273 @@ def init_log(myData):
     
     myData['logFile'].write('\nInput options:\n')
     for i in k:
-        if i in ['logFile']:
+        if i in ['logFile','alleleCounts','alleleIndels','mergedDepth']:
             continue        
         myData['logFile'].write('%s\t%s\n' % (i,myData[i]))                
     myData['logFile'].flush()  
+#############################################################################
+# per-sample run context, a dict so the pipeline functions keep using run[key],
+# with everything a run reads or writes kept in it so samples can run side by side
+# in one interpreter (--profile uses the process-wide tracemalloc, one sample at a time)
+class SampleRun(dict):
+    def close(self):
+        if 'logFile' in self and self['logFile'].closed is False:
+            self['logFile'].close()
+#############################################################################
+# --cram inputs are path or path:LIB, returns a dict per library. Files of a library
+# get tag in their name, a single input keeps the names of a one library run
+def parse_library_inputs(inputs):
+    if type(inputs) is str:
+        inputs = [inputs]
+    libs = []
+    for i in inputs:
+        path = i
+        name = None
+        if os.path.isfile(i) is False and ':' in i:
+            path,name = i.rsplit(':',1)
+        libs.append({'cram':path,'name':name})
+    if len(libs) > 255:
+        raise CallmitoError('at most 255 input libraries are supported')
+    for lib in libs:
+        if lib['name'] is None and len(libs) > 1:
+            lib['name'] = os.path.basename(lib['cram']).split('.')[0]
+        lib['tag'] = ''
+        if len(libs) > 1:
+            lib['tag'] = '.' + lib['name']
+    names = [lib['name'] for lib in libs]
+    for n in names:
+        if n is not None and (names.count(n) > 1 or n.strip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-.') != ''):
+            raise CallmitoError('library names must be unique and use only letters, digits, _ - and . : %s' % n)
+    return libs
+#############################################################################
+# options that must be given to setup_sample_run
+requiredOptions = ['ref','finalDir','sampleName','cramFileName','coordsFileName','mitoFa',
+                   'mitoFaRotated','chainFile','diagnosticTable']
+# defaults of the other options, given values must have the same type unless the default is None
+sampleDefaults = {'callEngine':'mutect2',
+                  'benchmarkCaller':False,
+                  'callShards':1,
+                  'alignThreads':1,
+                  'alignShardReads':0, # split each fastq into shards of this many reads for alignment, 0 is no split
+                  'preSubsample':False,
+                  'compressionPolicy':'fast',
+                  'compressThreads':1,
+                  'retention':'keep', # keep or clean, clean removes intermediates and keeps cram
+                  'profile':False,
+                  'rotatedSubset':False,
+                  'collapseDups':False,
+                  'resultsDB':None,
+                  'cohortDepth':None,
+                  'scratchDir':None,
+                  'roteTake':4000, # take 4000 first and last from the rotated
+                  'minAlleleFreq':0.5, # require >= 50% read support
+                  'minMitoDepth':3, # mask positions with lower depth in the fasta
+                  'strandBiasMode':'filter', # filter or ignore calls whose allele fails strand bias
+                  'callPadding':150, # bp of context around the kept windows when calling
+                  'rotatedSubsetPad':150, # reads this far inside the middle are not aligned to the rotated mito
+                  'maxCoverage':5000, # max coverage for downsampling
+                  'qcMinReads':0, # stop after extraction with fewer reads, 0 turns the check off
+                  'qcMinBreadth':0.0, # stop with less of the mito expected or found at minMitoDepth
+                  'qcMinMeanDepth':0.0, # stop after coverage with a lower mean depth
+                  'preSubsampleMargin':2.0, # keep this times maxCoverage when subsampling before alignment
+                  'pileupMinBaseQ':10,
+                  'pileupMinMapQ':20,
+                  'pileupMinAltReads':2, # emit a site when an alt allele has this many reads
+                  'pileupMinAltFrac':0.03, # and at least this fraction of the depth
+                  'strandBiasMinDepth':5, # need this many reads on each strand to test strand bias
+                  'strandBiasMaxRatio':0.1, # fail if allele freq on one strand is < this times the other
+                  'preflightCache':os.path.expanduser('~/.cache/callmito-single/preflight.json')} # cache of tool version checks, shared between runs
+#############################################################################
+# checks the options, makes the output (and scratch) dir and opens the log
+# returns the SampleRun to give to run_sample
+def setup_sample_run(options):
+    run = SampleRun()
+    for k in sampleDefaults:
+        run[k] = sampleDefaults[k]
+    for k in requiredOptions:
+        if options.get(k) is None:
+            raise CallmitoError('option %s is required' % k)
+    for k in options:
+        v = options[k]
+        if k in sampleDefaults and v is not None and sampleDefaults[k] is not None:
+            t = type(sampleDefaults[k])
+            if t is float and type(v) is int:
+                v = float(v)
+            if type(v) is not t:
+                raise CallmitoError('option %s should be %s, not %s' % (k,t.__name__,type(v).__name__))
+        elif k not in sampleDefaults and k not in requiredOptions:
+            raise CallmitoError('unknown option %s' % k)
+        run[k] = v
+    set_compression_policy(run)
+    run['libraries'] = parse_library_inputs(run['cramFileName'])
+
+    # interval list files, checked in preflight
+    run['mitoFaIntervalList'] = run['mitoFa'].replace('.fa','.interval_list')
+    run['mitoFaRotatedIntervalList'] = run['mitoFaRotated'].replace('.fa','.interval_list')
+
+    if run['finalDir'][-1] != '/':
+        run['finalDir'] += '/'
+    if os.path.isdir(run['finalDir']) is False:
+        raise CallmitoError('output dir %s not does not exist' % run['finalDir'])
+
+    # setup the output dir
+    run['finalDirSample'] = run['finalDir'] + run['sampleName'] + '/'
+    if os.path.isdir(run['finalDirSample']) is False:
+        print('making ',run['finalDirSample'])
+        os.mkdir(run['finalDirSample'])
+
+    # work on local scratch, finalDirSample is then the scratch dir and final
+    # outputs are copied to outDirSample at the end
+    run['useFifos'] = False
+    if run['scratchDir'] is not None:
+        if run['scratchDir'][-1] != '/':
+            run['scratchDir'] += '/'
+        if os.path.isdir(run['scratchDir']) is False:
+            raise CallmitoError('scratch dir %s not does not exist' % run['scratchDir'])
+        run['outDirSample'] = run['finalDirSample']
+        run['finalDirSample'] = run['scratchDir'] + run['sampleName'] + '/'
+        if os.path.isdir(run['finalDirSample']) is False:
+            os.mkdir(run['finalDirSample'])
+        run['useFifos'] = True
+
+    run['logFileName'] = run['finalDirSample'] + run['sampleName'] + '.mito.log'
+    run['logFile'] = open(run['logFileName'],'w')
+
+    # add initial info to log
+    init_log(run)
+    return run
+#############################################################################
+# sequence len and contig names, the fai files are checked in preflight
+def read_mito_fai(myData):
+    inFile = open(myData['mitoFa'] + '.fai','r')
+    line = inFile.readline()
+    line = line.rstrip()
+    line = line.split()
+    myData['mitoLen'] = int(line[1])
+    myData['mitoContig'] = line[0]
+    inFile.close()
+
+    inFile = open(myData['mitoFaRotated'] + '.fai','r')
+    line = inFile.readline()
+    line = line.rstrip()
+    line = line.split()
+    myData['mitoRotatedContig'] = line[0]
+    inFile.close()
+    myData['logFile'].write('mitoLen\t%i\nmitoContig\t%s\nmitoRotatedContig\t%s\n' % (myData['mitoLen'],myData['mitoContig'],myData['mitoRotatedContig']))
+#############################################################################
+# runs all stages for a sample, the log is closed even if a stage fails
+def run_sample(run):
+    try:
+        preflight_checks(run)
+        read_mito_fai(run)
+
+        # samples failing a qc gate stop with a qc-fail record and an all N fasta
+        try:
+            run_pipeline_stages(run)
+        except QCFail as e:
+            s = 'QC failed, stopping: %s' % e
+            print(s,flush=True)
+            run['logFile'].write(s + '\n')
+
+        # keep only reference based crams of the marked bams
+        if run['retention'] == 'clean' and 'mitoBamSortMD' in run:
+            run_stage(run,'compact_bams',compact_bams)
+    except Exception as e:
+        run['logFile'].write('ERROR! %s\n' % e)
+        run.close()
+        # keep the log and error record, on scratch the partial outputs go with the scratch dir
+        try:
+            write_error_record(run,e)
+            if run['scratchDir'] is not None:
+                stage_out(run,['logFileName','errorFile','stageTimesFile'])
+        except OSError as e2:
+            print('could not write the error record to %s: %s' % (run['finalDirSample'],e2),flush=True)
+        raise
+    finally:
+        run.close()
+
+    if run['scratchDir'] is not None:
+        stage_out(run)
+    if run['resultsDB'] is not None:
+        update_results_db(run)
+    if run['cohortDepth'] is not None and 'mitoMergePerBp' in run:
+        add_to_cohort_depth(run)
+#############################################################################
+# SAMPLE.error.txt, with the stage that failed and the traceback
+def write_error_record(myData,e):
+    myData['errorFile'] = myData['finalDirSample'] + myData['sampleName'] + '.error.txt'
+    outFile = open(myData['errorFile'],'w')
+    outFile.write('sample\t%s\n' % myData['sampleName'])
+    outFile.write('stage\t%s\n' % myData.get('currentStage','preflight_checks'))
+    outFile.write('error\t%s\n' % str(e).replace('\n',' '))
+    outFile.write('\n#traceback\n')
+    outFile.write(''.join(traceback.format_exception(type(e),e,e.__traceback__)))
+    outFile.close()
+#############################################################################
+# the pipeline stages of run_sample
+def run_pipeline_stages(run):
+    # get reads to extract
+    run_stage(run,'extract_reads',extract_reads)
+    qc_gate(run,'extract_reads',[['extractedReads',run['extractedReads'],run['qcMinReads']],
+                                 ['estBreadth',run['estBreadth'],run['qcMinBreadth']]])
+
+    # align to each mito
+    run_stage(run,'align_to_mitos',align_to_mitos)
+    run_stage(run,'run_coverage',run_coverage)
+    qc_gate(run,'run_coverage',[['meanDepth',run['meanDepth'],run['qcMinMeanDepth']],
+                                ['breadth',run['breadth'],run['qcMinBreadth']]])
+    run_stage(run,'down_sample',down_sample)
+
+    # run vcf
+    run_stage(run,'call_vars',call_vars)
+
+    # keep allele counts for re-calling without the bams
+    run_stage(run,'save_allele_store',save_allele_store)
+
+    # filter vcf
+    run_stage(run,'filter_germline',filter_germline)
+    if run['benchmarkCaller'] is True:
+        run_stage(run,'benchmark_callers',benchmark_callers)
+
+    # make fasta and mask
+    run_stage(run,'make_fasta_germline',make_fasta_germline)
+    run_stage(run,'assign_haplogroup',assign_haplogroup)
+#############################################################################
+# qc gate, stops samples that would come out almost fully masked before the slow steps
+class QCFail(Exception):
+    pass
+#############################################################################
+# checks are [name,value,minimum], a minimum of 0 turns a check off
+# on failure writes SAMPLE.qc-fail.txt and an all N SAMPLE.fa and raises QCFail
+def qc_gate(myData,gateName,checks):
+    failed = []
+    for c in checks:
+        if c[2] > 0 and c[1] < c[2]:
+            failed.append(c[0])
+    if len(failed) == 0:
+        return
+
+    myData['qcFail'] = myData['finalDirSample'] + myData['sampleName'] + '.qc-fail.txt'
+    outFile = open(myData['qcFail'],'w')
+    outFile.write('sample\t%s\n' % myData['sampleName'])
+    outFile.write('gate\t%s\n' % gateName)
+    outFile.write('#check\tvalue\tminimum\tresult\n')
+    for c in checks:
+        if c[2] <= 0:
+            continue
+        res = 'FAIL' if c[0] in failed else 'PASS'
+        outFile.write('%s\t%g\t%g\t%s\n' % (c[0],c[1],c[2],res))
+    outFile.close()
+
+    myData['mitoMergeFasta'] = myData['finalDirSample'] + myData['sampleName'] + '.fa'
+    outFile = open(myData['mitoMergeFasta'],'w')
+    outFile.write('>%s\n' % myData['sampleName'])
+    for i in range(0,myData['mitoLen'],60):
+        outFile.write('N' * min(60,myData['mitoLen']-i) + '\n')
+    outFile.close()
+
+    remove_intermediates(myData,[lib['fastq'] for lib in myData['libraries'] if 'fastq' in lib])
+    raise QCFail('%s gate failed %s, see %s' % (gateName,','.join(failed),myData['qcFail']))
 ############################################################################# 
 def parse_sam_line(myLine):
     res = {}
@@ -272,81 +830,501 @@ def extract_reads(myData):
     
     myData['logFile'].write('\nstarting extraction of fastq\n')
     
-    # due this one through a temp file name, as it may be very large and can break the pipe
+    # each library is extracted in its own thread so their samtools processes run in parallel
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(myData['libraries']))
+    libReads = list(pool.map(lambda lib: profiled_call(myData,extract_library_reads,myData,lib),myData['libraries']))
+    pool.shutdown()
+
+    # records of all libraries, with the index of the library of each read
+    myData['readRecords'] = []
+    myData['readPass'] = bytearray() # 1 if any line for the read passes extraction criteria
+    myData['readLib'] = bytearray()
+    for i in range(len(libReads)):
+        myData['readRecords'].extend(libReads[i][0])
+        myData['readPass'].extend(libReads[i][1])
+        myData['readLib'].extend(bytes([i]) * len(libReads[i][0]))
+    libReads = None
+
+    s = 'Have total of %i reads pass extraction criteria' % sum(myData['readPass'])    
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+
+    # get how many need extraction
     
-    myData['tmpSamFileName'] = myData['finalDirSample'] + 'tmp.extract.sam'
+    # collapse reads with identical sequence, keeping the best quality copy
+    if myData['collapseDups'] is True:
+        collapse_identical_reads(myData)
+        
+    # subsample before alignment if the extracted reads are way over max coverage
+    estimate_mito_depth(myData)
+    keepFrac = 1.0
+    if myData['preSubsample'] is True:
+        target = myData['maxCoverage'] * myData['preSubsampleMargin']
+        if myData['estMitoDepth'] > target:
+            keepFrac = target / myData['estMitoDepth']
+            s = 'subsampling reads before alignment, keeping fraction %f' % keepFrac
+            print(s,flush=True)
+            myData['logFile'].write(s + '\n')
+    myData['preSubsampleFraction'] = keepFrac
+        
+    # one fastq per library
+    writers = []
+    for lib in myData['libraries']:
+        lib['fastq'] = myData['finalDirSample'] + 'read%s.fq.gz' % lib['tag']
+        writers.append(open_bgzip_writer(myData,lib['fastq']))
+    for readId in range(len(myData['readRecords'])):
+        if myData['readPass'][readId] == 0:
+            continue
+        rec = myData['readRecords'][readId]
+        if keepFrac < 1.0 and keep_read_by_name(fastq_record_name(rec),keepFrac) is False:
+            continue
+        writers[myData['readLib'][readId]].stdin.write(rec)
+    for out1 in writers:
+        close_bgzip_writer(out1)
+     
+    s = 'reads written to output fastq files!'
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')          
+    myData['logFile'].flush() 
     
-    cmd = 'samtools view -T %s -M -L %s -o %s -O SAM %s  ' % (myData['ref'], myData['coordsFileName'],myData['tmpSamFileName'],myData['cramFileName'])
-    print(cmd)
-    runCMD(cmd)    
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()
-    myData['logFile'].write('DONE' + '\n')
-    myData['logFile'].flush()
-    print('DONE initial extraction',flush=True)
+    # free up memory
+    myData['readRecords'] = []
+    myData['readPass'] = bytearray()
+    myData['readLib'] = bytearray()
+###############################################################################
+# reads of one input library, returns [fastq records, pass flags]
+def extract_library_reads(myData,lib):
+    # due this one through a temp file name, as it may be very large and can break the pipe
+    tmpSamFileName = myData['finalDirSample'] + 'tmp.extract%s.sam' % lib['tag']
     
-    # these dictionaries can be large, requires some more memory when there is a lot of mito reads
-    myData['readData'] = {}  # dictionary to store all of read 1 and read 2 info
-    myData['readsToExtract'] = {} # dictionary of reads to extract
+    if myData['useFifos'] is True:
+        # on local scratch, read straight from samtools instead of the temp file
+        cmd = 'samtools view -T %s -M -L %s -O SAM %s  ' % (myData['ref'], myData['coordsFileName'],lib['cram'])
+        print(cmd)
+        myData['logFile'].write(cmd + '\n')
+        myData['logFile'].flush()
+        extractProc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+        tmpIn = extractProc.stdout
+    else:
+        cmd = 'samtools view -T %s -M -L %s -o %s -O SAM %s  ' % (myData['ref'], myData['coordsFileName'],tmpSamFileName,lib['cram'])
+        print(cmd)
+        runCMD(cmd)    
+        myData['logFile'].write(cmd + '\n')
+        myData['logFile'].flush()
+        myData['logFile'].write('DONE' + '\n')
+        myData['logFile'].flush()
+        print('DONE initial extraction',flush=True)
+        tmpIn = open(tmpSamFileName,'r')
+    
+    # one fastq record per read name, from the last line seen for that name
+    # names are looked up by hash so each is only stored once, inside its record
+    readRecords = []
+    readPass = bytearray()
+    passOrder = array.array('I') # read ids in the order they first pass
+    readNames = ReadNameIndex(lambda i: fastq_record_name(readRecords[i]))
     
     myData['logFile'].write('starting to read through extracted file' + '\n')
     myData['logFile'].flush()
   
-    tmpIn = open(myData['tmpSamFileName'],'r')
     for samLine in tmpIn:
         samLine = samLine.rstrip()
         samLine = samLine.split()
         samRec = parse_sam_line(samLine)
         
         
-        readNum = 1 # has to be -- only a single end read...
- 
-        if samRec['seqName'] not in myData['readData']:
-            myData['readData'][samRec['seqName']] = ['Empty','Empty']
-        # just save the samLine, which is the split list of the samfile line, this saves space    
-        myData['readData'][samRec['seqName']][readNum-1] = samLine        
-        if to_extract(samRec) is True:
-            myData['readsToExtract'][samRec['seqName']] = 1   
+        # has to be read 1 -- only a single end read...
+        seqInfo = get_seq_from_sam(samRec)
+        rec = '@%s\n%s\n+\n%s\n' % (samRec['seqName'],seqInfo[2],seqInfo[3])
+        readId,isNew = readNames.get_or_add(samRec['seqName'])
+        if isNew is True:
+            readRecords.append(rec)
+            readPass.append(0)
+        else:
+            readRecords[readId] = rec
+        if to_extract(samRec) is True and readPass[readId] == 0:
+            readPass[readId] = 1
+            passOrder.append(readId)
     tmpIn.close()
-    
-    s = 'Have total of %i reads pass extraction criteria' % len(myData['readsToExtract'])    
+    readNames = None
+    if myData['useFifos'] is True:
+        if extractProc.wait() != 0:
+            raise CallmitoError('command failed: %s' % extractProc.args)
+    else:
+        cmd = 'rm ' + tmpSamFileName
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')          
+        myData['logFile'].flush() 
+        runCMD(cmd)
+
+    # passing reads first, in the order they first passed, so the fastq is in the
+    # same order as when reads were kept in a dict of names to extract
+    numPass = len(passOrder)
+    records = [readRecords[i] for i in passOrder]
+    records.extend([readRecords[i] for i in range(len(readRecords)) if readPass[i] == 0])
+    readRecords = None
+    return [records,bytearray([1]) * numPass + bytearray(len(records) - numPass)]
+###############################################################################
+# read name of a fastq record string
+def fastq_record_name(rec):
+    return rec[1:rec.index('\n')]
+###############################################################################
+# 64 bit hash of a read name
+def name_hash64(name):
+    return int.from_bytes(hashlib.blake2b(name.encode(),digest_size=8).digest(),'little')
+###############################################################################
+# maps read names to ids 0,1,2... with an open addressed table of 64 bit name
+# hashes instead of a dict keyed by the names. Names are not stored here, nameOfId
+# returns the name for an id (from wherever the caller keeps it) so that two names
+# with the same hash are told apart exactly, the later ones go to a small dict.
+class ReadNameIndex:
+    def __init__(self,nameOfId,capacity=1024):
+        self.nameOfId = nameOfId
+        self.keys = np.zeros(capacity,dtype=np.uint64)
+        self.ids = np.full(capacity,-1,dtype=np.int64)
+        self.mask = capacity - 1
+        self.size = 0
+        self.collisions = {}
+
+    def __len__(self):
+        return self.size
+
+    # returns [id,True] for a new name, [id,False] for one already seen
+    def get_or_add(self,name):
+        h = name_hash64(name)
+        i = h & self.mask
+        while True:
+            readId = int(self.ids[i])
+            if readId == -1:
+                break
+            if int(self.keys[i]) == h:
+                if self.nameOfId(readId) == name:
+                    return [readId,False]
+                # different name with the same hash
+                if name in self.collisions:
+                    return [self.collisions[name],False]
+                self.collisions[name] = self.size
+                self.size += 1
+                return [self.size-1,True]
+            i = (i + 1) & self.mask
+        self.keys[i] = h
+        self.ids[i] = self.size
+        self.size += 1
+        if 2 * self.size > len(self.keys):
+            self.grow()
+        return [self.size-1,True]
+
+    def grow(self):
+        oldKeys = self.keys
+        oldIds = self.ids
+        self.keys = np.zeros(2*len(oldKeys),dtype=np.uint64)
+        self.ids = np.full(2*len(oldKeys),-1,dtype=np.int64)
+        self.mask = len(self.keys) - 1
+        for j in np.flatnonzero(oldIds != -1):
+            h = int(oldKeys[j])
+            i = h & self.mask
+            while self.ids[i] != -1:
+                i = (i + 1) & self.mask
+            self.keys[i] = h
+            self.ids[i] = oldIds[j]
+###############################################################################
+# returns [name,seq,qual] of a fastq record string
+def split_fastq_record(rec):
+    rec = rec.split('\n')
+    return [rec[0][1:],rec[1],rec[3]]
+###############################################################################
+# keep one read per exact sequence (in the original read orientation) among the
+# reads that pass extraction, the copy with the highest summed base quality is kept
+def collapse_identical_reads(myData):
+    records = myData['readRecords']
+    groupRep = [] # record id of the read kept for each sequence
+    groupScore = []
+    groupCount = []
+    # duplicates are only collapsed within a library
+    seqIndex = ReadNameIndex(lambda g: '%i\t%s' % (myData['readLib'][groupRep[g]],split_fastq_record(records[groupRep[g]])[1]))
+    numIn = 0
+    for readId in range(len(records)):
+        if myData['readPass'][readId] == 0:
+            continue
+        numIn += 1
+        name,seq,qual = split_fastq_record(records[readId])
+        score = sum(qual.encode())
+        g,isNew = seqIndex.get_or_add('%i\t%s' % (myData['readLib'][readId],seq))
+        if isNew is True:
+            groupRep.append(readId)
+            groupScore.append(score)
+            groupCount.append(1)
+            continue
+        groupCount[g] += 1
+        if score > groupScore[g]:
+            myData['readPass'][groupRep[g]] = 0
+            groupRep[g] = readId
+            groupScore[g] = score
+        else:
+            myData['readPass'][readId] = 0
+
+    # number of reads each kept read stands for, used for the duplicate metrics
+    myData['collapseCounts'] = {}
+    for g in range(len(groupRep)):
+        if groupCount[g] > 1:
+            myData['collapseCounts'][fastq_record_name(records[groupRep[g]])] = groupCount[g]
+
+    numUnique = len(groupRep)
+    myData['collapseMetrics'] = myData['finalDirSample'] + 'read.collapse_metrics.txt'
+    outFile = open(myData['collapseMetrics'],'w')
+    outFile.write('READS_IN\tUNIQUE_SEQUENCES\tREADS_COLLAPSED\tPERCENT_COLLAPSED\n')
+    if numIn == 0:
+        f = 0.0
+    else:
+        f = (numIn - numUnique) / numIn
+    outFile.write('%i\t%i\t%i\t%f\n' % (numIn,numUnique,numIn-numUnique,f))
+    outFile.close()
+
+    s = 'collapsed %i reads into %i unique sequences' % (numIn,numUnique)
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
+###############################################################################
+# duplication including the reads collapsed before alignment: each extra copy of a
+# mapped read is counted as an examined read and as a duplicate
+def write_collapse_dup_metrics(myData):
+    myData['collapseDupMetrics'] = myData['finalDirSample'] + 'collapse.dup_metrics.txt'
+    outFile = open(myData['collapseDupMetrics'],'w')
+    outFile.write('BAM\tREADS_EXAMINED\tREAD_DUPLICATES\tCOLLAPSED_BEFORE_ALIGNMENT\tPERCENT_DUPLICATION\n')
+    for bam in [myData['mitoBamSortMD'],myData['mitoRotatedBamSortMD']]:
+        examined = 0
+        dups = 0
+        collapsed = 0
+        cmd = 'samtools view -F 0x904 %s' % bam
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        proc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+        for samLine in proc.stdout:
+            samLine = samLine.split('\t',2)
+            extra = myData['collapseCounts'].get(samLine[0],1) - 1
+            examined += 1 + extra
+            collapsed += extra
+            dups += extra
+            if int(samLine[1]) & 0x400 != 0:
+                dups += 1
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise CallmitoError('command failed: %s' % cmd)
+        if examined == 0:
+            f = 0.0
+        else:
+            f = dups / examined
+        outFile.write('%s\t%i\t%i\t%i\t%f\n' % (os.path.basename(bam),examined,dups,collapsed,f))
+    outFile.close()
+    myData['logFile'].flush()
+###############################################################################
+# predict mean mito depth from the extracted reads, before any alignment
+def estimate_mito_depth(myData):
+    totBases = 0
+    numReads = 0
+    for readId in range(len(myData['readRecords'])):
+        if myData['readPass'][readId] == 1:
+            rec = myData['readRecords'][readId]
+            nameEnd = rec.index('\n')
+            totBases += rec.index('\n',nameEnd+1) - nameEnd - 1
+            numReads += 1
+    myData['extractedReads'] = numReads
+    myData['estMitoDepth'] = totBases / myData['mitoLen']
+    s = 'estimated mito depth from %i extracted bases is %f' % (totBases,myData['estMitoDepth'])
     print(s,flush=True)
     myData['logFile'].write(s + '\n')
 
-    # get how many need extraction
-        
-        
-    myData['fastqOutName'] = myData['finalDirSample'] + 'read.fq.gz'
-     
-    out1 = gzip.open(myData['fastqOutName'],'wt')
-    for rn in myData['readsToExtract']:
-        samRec = parse_sam_line(myData['readData'][rn][0])
-        seqInfo = get_seq_from_sam(samRec)
-        s = seqInfo[2]
-        q = seqInfo[3]
-        
-        out1.write('@%s\n%s\n+\n%s\n' % (rn,s,q))
-
-    out1.close()
-     
-    s = 'reads written to output fastq files!'
+    # expected fraction of the mito at minMitoDepth or more, if reads land uniformly (poisson)
+    term = np.exp(-myData['estMitoDepth'])
+    below = 0.0
+    for k in range(myData['minMitoDepth']):
+        below += term
+        term *= myData['estMitoDepth'] / (k + 1)
+    myData['estBreadth'] = max(0.0,1.0 - below)
+    s = 'estimated breadth at depth %i is %f' % (myData['minMitoDepth'],myData['estBreadth'])
     print(s,flush=True)
-    myData['logFile'].write(s + '\n')          
-    myData['logFile'].flush() 
-    
-    # free up memory
-    myData['readsToExtract'].clear()
-    myData['readData'].clear()
-    
-    
-    cmd = 'rm ' + myData['tmpSamFileName']
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
+###############################################################################
+# deterministic choice of reads to keep, based only on the read name
+def keep_read_by_name(readName,keepFrac):
+    h = hashlib.blake2b(readName.encode(),digest_size=8).digest()
+    if int.from_bytes(h,'little') < keepFrac * 2**64:
+        return True
+    return False
+###############################################################################
+# run bwa aln then samse, on scratch the sai is passed through a fifo so both run at once
+def run_aln_samse(myData,alnCmd,samseCmd,saiFileName):
+    print(alnCmd,flush=True)
+    myData['logFile'].write(alnCmd + '\n')
+    print(samseCmd,flush=True)
+    myData['logFile'].write(samseCmd + '\n')
+    myData['logFile'].flush()
+    if myData['useFifos'] is False:
+        runCMD(alnCmd)
+        runCMD(samseCmd)
+        return
+
+    if os.path.exists(saiFileName) is True:
+        os.remove(saiFileName)
+    os.mkfifo(saiFileName)
+    alnProc = subprocess.Popen(alnCmd, shell=True)
+    samseVal = subprocess.Popen(samseCmd, shell=True).wait()
+    if samseVal != 0:
+        alnProc.kill()  # may be blocked on the fifo
+    alnVal = alnProc.wait()
+    os.remove(saiFileName)
+    if alnVal != 0 or samseVal != 0:
+        raise CallmitoError('command failed: %s\n%s' % (alnCmd,samseCmd))
+###############################################################################
+# read group of a library, input without a library name keeps the single sample read group
+def library_read_group(myData,lib,rgId):
+    if lib['name'] is None:
+        return '@RG\\tID:%s\\tSM:%s\\tPL:Illumina' % (rgId,myData['sampleName'])
+    return '@RG\\tID:%s.%s\\tSM:%s\\tLB:%s\\tPL:Illumina' % (rgId,lib['name'],myData['sampleName'],lib['name'])
+###############################################################################
+# split a fastq into shards of shardReads reads, named by shard number so a given
+# shard size always gives the same shards, returns [fastq] if it fits in one shard
+def split_fastq_shards(myData,fastq,shardReads):
+    if shardReads <= 0:
+        return [fastq]
+    shards = []
+    out = None
+    n = 0
+    inFile = gzip.open(fastq,'rt')
+    while True:
+        rec = [inFile.readline() for i in range(4)]
+        if rec[0] == '':
+            break
+        if n % shardReads == 0:
+            if out is not None:
+                close_bgzip_writer(out)
+            shards.append(fastq.replace('.fq.gz','.shard%i.fq.gz' % len(shards)))
+            out = open_bgzip_writer(myData,shards[-1])
+        out.stdin.write(''.join(rec))
+        n += 1
+    inFile.close()
+    if out is not None:
+        close_bgzip_writer(out)
+    if len(shards) <= 1:
+        for f in shards:
+            os.remove(f)
+        return [fastq]
+    s = 'split %i reads of %s into %i shards' % (n,fastq,len(shards))
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    return shards
+###############################################################################
+# align the fastq of each library (lib[fastqKey]) in parallel, each with its own read
+# group, and merge them into one sorted bam so duplicates are marked per library
+# with alignShardReads each fastq is split and the shards are aligned on alignThreads workers,
+# the sorted shard bams are merged in shard order so the output only depends on the shard size
+def align_libraries(myData,refFa,fastqKey,bamFileName,rgId):
+    jobs = []
+    shardFastqs = []
+    for lib in myData['libraries']:
+        rg = '\'' + library_read_group(myData,lib,rgId) + '\''
+        shards = split_fastq_shards(myData,lib[fastqKey],myData['alignShardReads'])
+        if len(shards) > 1:
+            shardFastqs += shards
+        for n in range(len(shards)):
+            tag = lib['tag']
+            if len(shards) > 1:
+                tag += '.shard%i' % n
+            libBam = bamFileName.replace('.bam',tag + '.bam')
+            saiTMP = myData['finalDirSample'] + 'TMP%s.sai' % tag
+            fq = shards[n]
+            # do bwa aln/sampe thing...
+            alnCmd = f"bwa aln -t 1 -l 1024 -n 0.01 -o 2 {refFa}  {fq} > {saiTMP}"
+            samseCmd = f"bwa samse -r {rg} {refFa} {saiTMP} {fq} | samtools view -F 4 -h -u - | samtools sort{compress_opts(myData,'samtools')} - > {libBam} "
+            jobs.append([alnCmd,samseCmd,saiTMP,libBam])
+
+    numWorkers = min(len(jobs),myData['alignThreads'])
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers)
+    futures = [pool.submit(run_aln_samse,myData,j[0],j[1],j[2]) for j in jobs]
+    pool.shutdown()
+    for f in futures:
+        f.result()
+
+    if len(shardFastqs) > 0:
+        cmd = 'rm ' + ' '.join(shardFastqs)
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        runCMD(cmd)
+
+    if myData['useFifos'] is False:
+        cmd = 'rm ' + ' '.join([j[2] for j in jobs])
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        myData['logFile'].flush()                      
+        runCMD(cmd)
+
+    if len(jobs) == 1:
+        return
+    # -c -p keep one copy of the read group and program lines repeated across shards
+    cmd = 'samtools merge -f -c -p%s %s %s' % (compress_opts(myData,'samtools'),bamFileName,' '.join([j[3] for j in jobs]))
     print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')          
-    myData['logFile'].flush() 
+    myData['logFile'].write(cmd + '\n')
     runCMD(cmd)
+    cmd = 'rm ' + ' '.join([j[3] for j in jobs])
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    myData['logFile'].flush()
+    runCMD(cmd)
+###############################################################################
+# length of reference covered by an expanded cigar
+def cigar_ref_len(cigarExpand):
+    refLen = 0
+    for c in cigarExpand:
+        if c[1] in 'MDN=X':
+            refLen += c[0]
+    return refLen
+###############################################################################
+# write the reads to align to the rotated mito: everything except reads placed
+# unclipped well inside the middle of the standard mito, which is not taken from the rotated
+def write_rotated_subset_fastq(myData):
+    middleStart = myData['roteTake'] + 1 + myData['rotatedSubsetPad']
+    middleEnd = myData['mitoLen'] - myData['roteTake'] - myData['rotatedSubsetPad']
+
+    middleReads = set()
+    cmd = 'samtools view -F 0x904 %s' % myData['mitoBam']
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    proc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+    for samLine in proc.stdout:
+        samLine = samLine.split('\t',6)
+        cigar = samLine[5]
+        if 'S' in cigar or 'H' in cigar:
+            continue
+        pos = int(samLine[3])
+        end = pos + cigar_ref_len(expand_cigar(cigar)) - 1
+        if pos >= middleStart and end <= middleEnd:
+            middleReads.add(samLine[0])
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise CallmitoError('command failed: %s' % cmd)
+
+    numKept = 0
+    numTot = 0
+    for lib in myData['libraries']:
+        lib['fastqRotated'] = myData['finalDirSample'] + 'read.rotated%s.fq.gz' % lib['tag']
+        inFile = gzip.open(lib['fastq'],'rt')
+        out1 = open_bgzip_writer(myData,lib['fastqRotated'])
+        while True:
+            rec = [inFile.readline() for i in range(4)]
+            if rec[0] == '':
+                break
+            numTot += 1
+            if rec[0][1:].rstrip() in middleReads:
+                continue
+            numKept += 1
+            out1.stdin.write(''.join(rec))
+        inFile.close()
+        close_bgzip_writer(out1)
 
-
-    
+    s = 'aligning %i of %i reads to the rotated mito' % (numKept,numTot)
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
 ###############################################################################        
 def align_to_mitos(myData):
     s = 'align to the two mitos'
@@ -356,73 +1334,37 @@ def align_to_mitos(myData):
     myData['mitoBam']= myData['finalDirSample'] + 'mito.bam'
     myData['mitoRotatedBam']= myData['finalDirSample'] + 'mitoRotated.bam'    
 
-    saiTMP = myData['finalDirSample'] + 'TMP.sai'
-
-    
     # align to mito
-    rg = '@RG\\tID:norm\\tSM:%s\\tPL:Illumina' % (myData['sampleName'])
-    rg = '\'' + rg + '\''
-    print('rg is',rg)
-    
-    # do bwa aln/sampe thing...
-    cmd = f"bwa aln -t 1 -l 1024 -n 0.01 -o 2 {myData['mitoFa']}  {myData['fastqOutName']} > {saiTMP}"
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()                      
-    runCMD(cmd)
-    
-    cmd = f"bwa samse -r {rg} {myData['mitoFa']} {saiTMP} {myData['fastqOutName']} | samtools view -F 4 -h -b - | samtools sort - > {myData['mitoBam']} "
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()                      
-    runCMD(cmd)
-    
-    
-    
-    
-    # align to rotated mito
-    rg = '@RG\\tID:rotate\\tSM:%s\\tPL:Illumina' % (myData['sampleName'])
-    rg = '\'' + rg + '\''
-    print('rg is',rg)
-
-    cmd = f"bwa aln -t 1 -l 1024 -n 0.01 -o 2 {myData['mitoFaRotated']}  {myData['fastqOutName']} > {saiTMP}"
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()                      
-    runCMD(cmd)
-    
-    cmd = f"bwa samse -r {rg} {myData['mitoFaRotated']} {saiTMP} {myData['fastqOutName']} | samtools view -F 4 -h -b - | samtools sort - > {myData['mitoRotatedBam']} "
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()                      
-    runCMD(cmd)
-    
-    
-    cmd = 'rm ' + saiTMP
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')
-    myData['logFile'].flush()                      
-    runCMD(cmd)
-    
-    
-    
+    align_libraries(myData,myData['mitoFa'],'fastq',myData['mitoBam'],'norm')
 
+    # align to rotated mito
+    # only the reads that can reach the kept windows go to the rotated mito
+    rotatedFastq = 'fastq'
+    if myData['rotatedSubset'] is True:
+        write_rotated_subset_fastq(myData)
+        rotatedFastq = 'fastqRotated'
+    align_libraries(myData,myData['mitoFaRotated'],rotatedFastq,myData['mitoRotatedBam'],'rotate')
+    readFastqs = [lib['fastq'] for lib in myData['libraries']]
+    if myData['rotatedSubset'] is True:
+        readFastqs += [lib['fastqRotated'] for lib in myData['libraries']]
+    remove_intermediates(myData,readFastqs)
 
     # sort and markdups
     myData['mitoBamSort'] = myData['finalDirSample'] + 'mito.sort.bam'
     myData['mitoRotatedBamSort'] = myData['finalDirSample'] + 'mitoRotated.sort.bam'    
     
-    cmd = 'gatk SortSam -SO coordinate -I %s -O %s ' % (myData['mitoBam'],myData['mitoBamSort'])
+    cmd = 'gatk SortSam -SO coordinate -I %s -O %s %s' % (myData['mitoBam'],myData['mitoBamSort'],compress_opts(myData,'picard'))
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
 
-    cmd = 'gatk SortSam -SO coordinate -I %s -O %s ' % (myData['mitoRotatedBam'],myData['mitoRotatedBamSort'])
+    cmd = 'gatk SortSam -SO coordinate -I %s -O %s %s' % (myData['mitoRotatedBam'],myData['mitoRotatedBamSort'],compress_opts(myData,'picard'))
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     myData['logFile'].flush()    
 
     runCMD(cmd)
+    remove_intermediates(myData,[myData['mitoBam'],myData['mitoRotatedBam']])
     
     # mark duplicates
     myData['mitoBamSortMD'] = myData['finalDirSample'] + 'mito.sort.markdup.bam'
@@ -440,6 +1382,7 @@ def align_to_mitos(myData):
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
+    remove_intermediates(myData,[myData['mitoBamSort'],myData['mitoRotatedBamSort']])
     
     # index    
     cmd = 'samtools index %s' % myData['mitoBamSortMD']
@@ -453,6 +1396,9 @@ def align_to_mitos(myData):
     runCMD(cmd)
     myData['logFile'].flush()    
     
+    if myData['collapseDups'] is True:
+        write_collapse_dup_metrics(myData)
+    
 ###############################################################################        
 def run_coverage(myData):
 # get covergage
@@ -563,6 +1509,7 @@ def run_coverage(myData):
     myData['minDepth'] = min(allDepth)
     myData['maxDepth'] = max(allDepth)
     myData['medDepth'] = np.median(allDepth)
+    myData['breadth'] = np.mean(np.array(allDepth) >= myData['minMitoDepth'])
     
     myData['mitoMergePerBpStats'] = myData['mitoMergePerBp'].replace('.txt','.stats')
     outFile = open(myData['mitoMergePerBpStats'],'w')
@@ -570,6 +1517,8 @@ def run_coverage(myData):
         outFile.write('%s\t%i\n' % (i,myData[i]))
         print('%s\t%i' % (i,myData[i]))
     outFile.close()
+    remove_intermediates(myData,[myData['mitoPerBp'],myData['mitoRotatedPerBp'],myData['mitoRotatedPerBpBED'],
+                                 myData['mitoRotatedPerBpBEDlift'],myData['mitoRotatedPerBpBEDliftFail']])
     
     myData['logFile'].flush()    
     
@@ -633,11 +1582,43 @@ def down_sample(myData):
     myData['logFile'].write(cmd + '\n')      
     runCMD(cmd)   
     print(cmd)
+    remove_intermediates(myData,[myData['mitoBamOrig'],myData['mitoRotatedBamOrig']])
     
     myData['logFile'].flush()
     
 ###################################################################################################
+# convert the marked bams to reference based cram once nothing reads the bams anymore,
+# reading them back needs mitoFa and mitoFaRotated
+def compact_bams(myData):
+    for k,refKey in [['mitoBamSortMD','mitoFa'],['mitoRotatedBamSortMD','mitoFaRotated']]:
+        cramFileName = myData[k].replace('.bam','.cram')
+        cmd = 'samtools view -C -T %s%s -o %s %s' % (myData[refKey],compress_opts(myData,'samtools',final=True),cramFileName,myData[k])
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        runCMD(cmd)
+
+        cmd = 'samtools index %s' % cramFileName
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        runCMD(cmd)
+        remove_intermediates(myData,[myData[k]])
+        myData[k] = cramFileName
+    myData['logFile'].flush()
+###################################################################################################
 def call_vars(myData):
+# call the mitochondrial variants with the selected engine
+    t = time.time()
+    if myData['callEngine'] == 'pileup':
+        call_vars_pileup(myData)
+    else:
+        call_vars_mutect2(myData)
+    myData['callVarsTime'] = time.time() - t
+    s = 'calling with %s took %.1f seconds' % (myData['callEngine'],myData['callVarsTime'])
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
+###################################################################################################
+def call_vars_mutect2(myData):
 # call the mitochondrial variants
     myData['mitoVCF'] = myData['finalDirSample'] + 'mito.vcf.gz'
     myData['mitoRotatedVCF'] = myData['finalDirSample'] + 'mitoRotated.vcf.gz'
@@ -650,31 +1631,26 @@ def call_vars(myData):
     myData['mitoRotatedVCFFilter'] = myData['mitoRotatedVCF'] + '.filter.gz'    
     
 
-    cmd = 'gatk Mutect2 --max-reads-per-alignment-start 75 --max-mnp-distance 0 -R %s --mitochondria-mode -I %s --annotation StrandBiasBySample -O %s' % (myData['mitoFa'],myData['mitoBamSortMD'],myData['mitoVCF']) 
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')              
-    runCMD(cmd)
-
-    cmd = 'gatk Mutect2 --max-reads-per-alignment-start 75 --max-mnp-distance 0 -R %s --mitochondria-mode -I %s --annotation StrandBiasBySample -O %s' % (myData['mitoFaRotated'],myData['mitoRotatedBamSortMD'],myData['mitoRotatedVCF']) 
-    print(cmd,flush=True)
-    myData['logFile'].write(cmd + '\n')              
-    runCMD(cmd)
+    # only call the windows that are kept in the merge
+    intervals = get_call_intervals(myData)
+    run_mutect2(myData,myData['mitoFa'],myData['mitoBamSortMD'],myData['mitoContig'],intervals['mito'],myData['mitoVCF'])
+    run_mutect2(myData,myData['mitoFaRotated'],myData['mitoRotatedBamSortMD'],myData['mitoRotatedContig'],intervals['rotated'],myData['mitoRotatedVCF'])
 
 
     # filter..
-    cmd = 'gatk FilterMutectCalls --mitochondria-mode -R %s -V %s -O %s ' % (myData['mitoFa'],myData['mitoVCF'],myData['mitoVCFFilter'] )
+    cmd = 'gatk FilterMutectCalls --mitochondria-mode -R %s -V %s -O %s %s' % (myData['mitoFa'],myData['mitoVCF'],myData['mitoVCFFilter'],compress_opts(myData,'gatk') )
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
 
-    cmd = 'gatk FilterMutectCalls --mitochondria-mode -R %s -V %s -O %s ' % (myData['mitoFaRotated'],myData['mitoRotatedVCF'],myData['mitoRotatedVCFFilter'] )
+    cmd = 'gatk FilterMutectCalls --mitochondria-mode -R %s -V %s -O %s %s' % (myData['mitoFaRotated'],myData['mitoRotatedVCF'],myData['mitoRotatedVCFFilter'],compress_opts(myData,'gatk') )
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
 
 
     # run liftover vcf    
-    cmd = 'gatk LiftoverVcf -I %s -O %s -CHAIN %s -REJECT %s -R %s ' % (myData['mitoRotatedVCFFilter'],myData['mitoRotatedVCFLift'],myData['chainFile'],myData['mitoRotatedVCFLiftFail'],myData['mitoFa'] )    
+    cmd = 'gatk LiftoverVcf -I %s -O %s -CHAIN %s -REJECT %s -R %s %s' % (myData['mitoRotatedVCFFilter'],myData['mitoRotatedVCFLift'],myData['chainFile'],myData['mitoRotatedVCFLiftFail'],myData['mitoFa'],compress_opts(myData,'picard') )    
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
@@ -689,11 +1665,8 @@ def call_vars(myData):
     for line in inFile:
         if line[0] == '#':
             continue
-        line = line.rstrip()
-        line = line.split()
-        line[1] = int(line[1])
         #line[6] = '.' # keep filter results
-        liftedVCF.append(line)
+        liftedVCF.append(VCFRecord(line))
     inFile.close()
     print('read in %i from %s' % (len(liftedVCF),myData['mitoRotatedVCFLift']))
 
@@ -702,11 +1675,8 @@ def call_vars(myData):
     for line in inFile:
         if line[0] == '#':
             continue
-        line = line.rstrip()
-        line = line.split()
-        line[1] = int(line[1])
         #line[6] = '.' # keep filter results
-        mitoVCF.append(line)
+        mitoVCF.append(VCFRecord(line))
     inFile.close()
     print('read in %i from %s' % (len(mitoVCF),myData['mitoVCF']))
 
@@ -721,30 +1691,23 @@ def call_vars(myData):
     
     # part 1
     for row in liftedVCF:
-        if row[1] <= myData['roteTake']:
-            nl = row
-            nl = [str(i) for i in nl]
-            nl = '\t'.join(nl) + '\n'
-            outFile.write(nl)
+        if row.pos() <= myData['roteTake']:
+            outFile.write(row.to_line())
     # middle part
     for row in mitoVCF:
-        if row[1] > myData['roteTake'] and row[1] < (myData['mitoLen']-myData['roteTake'] +1 ):
-            nl = row
-            nl = [str(i) for i in nl]
-            nl = '\t'.join(nl) + '\n'
-            outFile.write(nl)
+        if row.pos() > myData['roteTake'] and row.pos() < (myData['mitoLen']-myData['roteTake'] +1 ):
+            outFile.write(row.to_line())
     
     # end part
     for row in liftedVCF:
-        if row[1] >= (myData['mitoLen']-myData['roteTake'] +1 ):
-            nl = row
-            nl = [str(i) for i in nl]
-            nl = '\t'.join(nl) + '\n'
-            outFile.write(nl)
+        if row.pos() >= (myData['mitoLen']-myData['roteTake'] +1 ):
+            outFile.write(row.to_line())
     outFile.close()
+    remove_intermediates(myData,[myData['mitoVCF'],myData['mitoRotatedVCF'],myData['mitoVCFFilter'],myData['mitoRotatedVCFFilter'],
+                                 myData['mitoRotatedVCFLift'],myData['mitoRotatedVCFLiftFail']])
     
     # compress and tabix
-    cmd = 'bgzip %s' % myData['mitoMergeVCF']
+    cmd = 'bgzip%s %s' % (compress_opts(myData,'bgzip',final=True),myData['mitoMergeVCF'])
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
@@ -757,6 +1720,583 @@ def call_vars(myData):
     myData['logFile'].flush()    
     
     
+###################################################################################################
+# intervals of each reference that end up in the merged calls, padded so that
+# calls at the window edges see the same context as a whole genome run
+def get_call_intervals(myData):
+    pad = myData['callPadding']
+    intervals = {}
+    start = max(1,myData['roteTake'] + 1 - pad)
+    end = min(myData['mitoLen'],myData['mitoLen'] - myData['roteTake'] + pad)
+    intervals['mito'] = [[start,end]]
+
+    # rotated positions that lift to the kept ends
+    liftPos = read_chain_map(myData['chainFile'])
+    runs = []
+    for r in range(1,len(liftPos)):
+        if liftPos[r] == 0 or take_from_rotated(myData,liftPos[r]) is False:
+            continue
+        if len(runs) > 0 and runs[-1][1] == r - 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r,r])
+    intervals['rotated'] = []
+    for r in runs:
+        intervals['rotated'].append([max(1,r[0]-pad),min(len(liftPos)-1,r[1]+pad)])
+    return intervals
+###################################################################################################
+# split intervals into numShards pieces of about the same number of bases
+def shard_intervals(intervals,numShards):
+    total = sum([i[1]-i[0]+1 for i in intervals])
+    shardSize = -(-total // numShards)
+    shards = []
+    current = []
+    currentSize = 0
+    for i in intervals:
+        start = i[0]
+        while start <= i[1]:
+            end = min(i[1],start + shardSize - currentSize - 1)
+            current.append([start,end])
+            currentSize += end - start + 1
+            start = end + 1
+            if currentSize == shardSize:
+                shards.append(current)
+                current = []
+                currentSize = 0
+    if len(current) > 0:
+        shards.append(current)
+    return shards
+###################################################################################################
+# run Mutect2 over the intervals, in parallel shards that are gathered into outVCF
+def run_mutect2(myData,refFa,bamFileName,contig,intervals,outVCF):
+    baseCmd = 'gatk Mutect2 --max-reads-per-alignment-start 75 --max-mnp-distance 0 -R %s --mitochondria-mode -I %s --annotation StrandBiasBySample%s' % (refFa,bamFileName,compress_opts(myData,'gatk'))
+    shards = shard_intervals(intervals,myData['callShards'])
+    if len(shards) == 1:
+        cmd = baseCmd
+        for i in shards[0]:
+            cmd += ' -L %s:%i-%i' % (contig,i[0],i[1])
+        cmd += ' -O %s' % outVCF
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        runCMD(cmd)
+        return
+
+    cmds = []
+    shardVCFs = []
+    for n in range(len(shards)):
+        shardVCF = outVCF.replace('.vcf.gz','.shard%i.vcf.gz' % n)
+        shardVCFs.append(shardVCF)
+        cmd = baseCmd
+        for i in shards[n]:
+            cmd += ' -L %s:%i-%i' % (contig,i[0],i[1])
+        cmd += ' -O %s' % shardVCF
+        print(cmd,flush=True)
+        myData['logFile'].write(cmd + '\n')
+        cmds.append(cmd)
+    myData['logFile'].flush()
+    runCMD_parallel(cmds,myData['callShards'])
+
+    # gather calls and stats, FilterMutectCalls looks for outVCF.stats
+    cmd = 'gatk MergeVcfs -O %s%s' % (outVCF,compress_opts(myData,'picard'))
+    for v in shardVCFs:
+        cmd += ' -I %s' % v
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    runCMD(cmd)
+
+    cmd = 'gatk MergeMutectStats -O %s.stats' % outVCF
+    for v in shardVCFs:
+        cmd += ' -stats %s.stats' % v
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    runCMD(cmd)
+
+    cmd = 'rm'
+    for v in shardVCFs:
+        cmd += ' %s %s.tbi %s.stats' % (v,v,v)
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    myData['logFile'].flush()
+    runCMD(cmd)
+###################################################################################################
+# columns of the allele count matrix, indels are counted at the base before them
+alleleCols = ['A','C','G','T','DEL','INS']
+baseCodeTable = bytes.maketrans(b'ACGTacgt',b'\x00\x01\x02\x03\x00\x01\x02\x03')
+###################################################################################################
+# read the sequence of the first record in a fasta file
+def read_fasta_seq(faFileName):
+    seq = []
+    inFile = open(faFileName,'r')
+    for line in inFile:
+        line = line.rstrip()
+        if line == '':
+            continue
+        if line[0] == '>':
+            if len(seq) > 0:
+                break
+            continue
+        seq.append(line)
+    inFile.close()
+    seq = ''.join(seq)
+    return seq.upper()
+###################################################################################################
+# reads a liftOver chain file, returns array of lifted 1-based positions
+# indexed by 1-based position in the source sequence, 0 if the position does not lift
+def read_chain_map(chainFileName):
+    liftPos = None
+    inFile = open(chainFileName,'r')
+    for line in inFile:
+        line = line.rstrip()
+        if line == '' or line[0] == '#':
+            continue
+        line = line.split()
+        if line[0] == 'chain':
+            if line[4] != '+' or line[9] != '+':
+                raise CallmitoError('only + strand chains are supported in %s' % chainFileName)
+            if liftPos is None:
+                liftPos = np.zeros(int(line[3])+1,dtype=np.int64)
+            tPos = int(line[5])
+            qPos = int(line[10])
+            continue
+        size = int(line[0])
+        liftPos[tPos+1:tPos+size+1] = np.arange(qPos+1,qPos+size+1)
+        tPos += size
+        qPos += size
+        if len(line) == 3:
+            tPos += int(line[1])
+            qPos += int(line[2])
+    inFile.close()
+    return liftPos
+###################################################################################################
+# true if the position in the original coordinates is taken from the rotated reference
+def take_from_rotated(myData,pos):
+    if pos <= myData['roteTake'] or pos >= (myData['mitoLen']-myData['roteTake'] +1 ):
+        return True
+    return False
+###################################################################################################
+# add a batch of aligned read segments to the count matrix
+def add_segments_to_counts(counts,segStarts,segLens,segStrands,segSeqs,segQuals,minBaseQ):
+    lens = np.array(segLens,dtype=np.int64)
+    codes = np.frombuffer(''.join(segSeqs).encode().translate(baseCodeTable),dtype=np.uint8)
+    quals = np.frombuffer(''.join(segQuals).encode(),dtype=np.uint8).astype(np.int64) - 33
+    offsets = np.repeat(np.cumsum(lens) - lens,lens)
+    pos = np.repeat(np.array(segStarts,dtype=np.int64),lens) + np.arange(len(codes)) - offsets - 1
+    strands = np.repeat(np.array(segStrands,dtype=np.int64),lens)
+    keep = (codes < 4) & (quals >= minBaseQ) & (pos < counts.shape[0])
+    flat = (pos[keep]*counts.shape[1] + codes[keep])*2 + strands[keep]
+    counts += np.bincount(flat,minlength=counts.size).reshape(counts.shape).astype(np.uint32)
+###################################################################################################
+# one streaming pass over a bam, returns position x allele x strand count matrix
+# and the observed indel alleles, keyed by (pos,'DEL' or 'INS')
+# regions limits the count to reads overlapping them, each read is counted once
+def count_alleles_bam(myData,bamFileName,seqLen,regions=None):
+    counts = np.zeros((seqLen,len(alleleCols),2),dtype=np.uint32)
+    indels = {}
+    minBaseQ = myData['pileupMinBaseQ']
+    segStarts = []
+    segLens = []
+    segStrands = []
+    segSeqs = []
+    segQuals = []
+
+    # cram input is decoded against pileupRef when it is set
+    refOpt = ''
+    if myData.get('pileupRef') is not None:
+        refOpt = ' -T %s' % myData['pileupRef']
+    cmd = 'samtools view%s -F 0xF04 -q %i %s' % (refOpt,myData['pileupMinMapQ'],bamFileName)
+    if regions is not None:
+        cmd = 'samtools view%s -M -F 0xF04 -q %i %s %s' % (refOpt,myData['pileupMinMapQ'],bamFileName,' '.join(regions))
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    myData['logFile'].flush()
+    proc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+    for samLine in proc.stdout:
+        samLine = samLine.rstrip()
+        samLine = samLine.split('\t')
+        samRec = parse_sam_line(samLine)
+        if samRec['seq'] == '*':
+            continue
+        seq = samRec['seq']
+        qual = samRec['qual']
+        if qual == '*':
+            qual = chr(minBaseQ+33) * len(seq)
+        if samRec['reverseStrand'] is True:
+            strand = 1
+        else:
+            strand = 0
+
+        refPos = samRec['chromPos']
+        readPos = 0
+        cig = samRec['cigarExpand']
+        for ci in range(len(cig)):
+            n = cig[ci][0]
+            op = cig[ci][1]
+            if op in 'M=X':
+                takeLen = n
+                if ci + 1 < len(cig) and cig[ci+1][1] in 'ID' and n > 0:
+                    # last base of the block is the anchor of the indel
+                    takeLen = n - 1
+                    anchor = refPos + n - 1
+                    if cig[ci+1][1] == 'D':
+                        col = 'DEL'
+                        allele = cig[ci+1][0]
+                    else:
+                        col = 'INS'
+                        allele = seq[readPos+n:readPos+n+cig[ci+1][0]].upper()
+                    if anchor <= seqLen:
+                        counts[anchor-1,alleleCols.index(col),strand] += 1
+                        k = (anchor,col)
+                        if k not in indels:
+                            indels[k] = {}
+                        indels[k][allele] = indels[k].get(allele,0) + 1
+                if takeLen > 0:
+                    segStarts.append(refPos)
+                    segLens.append(takeLen)
+                    segStrands.append(strand)
+                    segSeqs.append(seq[readPos:readPos+takeLen])
+                    segQuals.append(qual[readPos:readPos+takeLen])
+                refPos += n
+                readPos += n
+            elif op in 'IS':
+                readPos += n
+            elif op in 'DN':
+                refPos += n
+
+        if len(segStarts) >= 100000:
+            add_segments_to_counts(counts,segStarts,segLens,segStrands,segSeqs,segQuals,minBaseQ)
+            segStarts = []
+            segLens = []
+            segStrands = []
+            segSeqs = []
+            segQuals = []
+    proc.stdout.close()
+    val = proc.wait()
+    if val != 0:
+        raise CallmitoError('command failed: %s' % cmd)
+    if len(segStarts) > 0:
+        add_segments_to_counts(counts,segStarts,segLens,segStrands,segSeqs,segQuals,minBaseQ)
+    return [counts,indels]
+###################################################################################################
+# merge standard and rotated counts into the original coordinates
+# same windows as the vcf and depth merge
+def merge_allele_counts(myData,mitoCounts,mitoIndels,rotCounts,rotIndels):
+    liftPos = read_chain_map(myData['chainFile'])
+    counts = mitoCounts.copy()
+    indels = {}
+    for r in range(1,len(liftPos)):
+        p = liftPos[r]
+        if p != 0 and take_from_rotated(myData,p) is True:
+            counts[p-1] = rotCounts[r-1]
+
+    for k in mitoIndels:
+        if take_from_rotated(myData,k[0]) is False:
+            indels[k] = mitoIndels[k]
+    for k in rotIndels:
+        p = int(liftPos[k[0]])
+        if p != 0 and take_from_rotated(myData,p) is True:
+            indels[(p,k[1])] = rotIndels[k]
+    return [counts,indels]
+###################################################################################################
+# check strand counts of an allele, true if it is only supported on one strand
+# when there is enough coverage on both strands to see it
+def strand_bias_fails(myData,refF,refR,altF,altR):
+    depthF = refF + altF
+    depthR = refR + altR
+    if depthF < myData['strandBiasMinDepth'] or depthR < myData['strandBiasMinDepth']:
+        return False
+    afF = altF / depthF
+    afR = altR / depthR
+    if max(afF,afR) == 0:
+        return False
+    if min(afF,afR) < myData['strandBiasMaxRatio'] * max(afF,afR):
+        return True
+    return False
+###################################################################################################
+# write a vcf from an allele count matrix, with the AD, SB and AS_FilterStatus
+# fields that filter_germline uses
+def write_allele_count_vcf(myData,counts,indels,refSeq,vcfFileName):
+    outFile = open(vcfFileName,'w')
+    outFile.write('##fileformat=VCFv4.2\n')
+    outFile.write('##FILTER=<ID=PASS,Description="All filters passed">\n')
+    outFile.write('##FILTER=<ID=strand_bias,Description="Evidence for alt allele comes from one read direction only">\n')
+    outFile.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth after base and mapping quality filters">\n')
+    outFile.write('##INFO=<ID=AS_SB_TABLE,Number=1,Type=String,Description="Allele-specific forward/reverse read counts">\n')
+    outFile.write('##INFO=<ID=AS_FilterStatus,Number=A,Type=String,Description="Filter status for each allele">\n')
+    outFile.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    outFile.write('##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths for the ref and alt alleles">\n')
+    outFile.write('##FORMAT=<ID=AF,Number=A,Type=Float,Description="Allele fractions of alternate alleles">\n')
+    outFile.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n')
+    outFile.write('##FORMAT=<ID=SB,Number=4,Type=Integer,Description="Ref forward, ref reverse, alt forward, alt reverse read counts">\n')
+    outFile.write('##contig=<ID=%s,length=%i>\n' % (myData['mitoContig'],len(refSeq)))
+    outFile.write('##source=callmito_single_pileup\n')
+    outFile.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t%s\n' % myData['sampleName'])
+
+    alleleTot = counts.sum(axis=2)
+    depth = alleleTot.sum(axis=1)
+    numRecords = 0
+    for p in range(1,len(refSeq)+1):
+        refBase = refSeq[p-1]
+        if refBase not in ['A','C','G','T']:
+            continue
+        dp = int(depth[p-1])
+        if dp == 0:
+            continue
+        refCol = alleleCols.index(refBase)
+        alts = []
+        for col in range(len(alleleCols)):
+            if col == refCol:
+                continue
+            n = int(alleleTot[p-1,col])
+            if n < myData['pileupMinAltReads'] or n/dp < myData['pileupMinAltFrac']:
+                continue
+            alts.append(col)
+        if len(alts) == 0:
+            continue
+
+        # the most common allele stands for each indel type at the position
+        delLen = 0
+        if alleleCols.index('DEL') in alts:
+            d = indels[(p,'DEL')]
+            delLen = max(d,key=d.get)
+            if p + delLen > len(refSeq):  # would run off the end, skip it
+                alts.remove(alleleCols.index('DEL'))
+                delLen = 0
+        if len(alts) == 0:
+            continue
+        ref = refSeq[p-1:p+delLen]
+        altSeqs = []
+        for col in alts:
+            if alleleCols[col] == 'DEL':
+                altSeqs.append(refBase)
+            elif alleleCols[col] == 'INS':
+                d = indels[(p,'INS')]
+                altSeqs.append(refBase + max(d,key=d.get) + ref[1:])
+            else:
+                altSeqs.append(alleleCols[col] + ref[1:])
+
+        c = counts[p-1]
+        ad = [int(alleleTot[p-1,refCol])]
+        sbTable = ['%i,%i' % (c[refCol,0],c[refCol,1])]
+        asFilter = []
+        af = []
+        altF = 0
+        altR = 0
+        for col in alts:
+            ad.append(int(alleleTot[p-1,col]))
+            sbTable.append('%i,%i' % (c[col,0],c[col,1]))
+            af.append('%.3f' % (alleleTot[p-1,col]/dp))
+            altF += int(c[col,0])
+            altR += int(c[col,1])
+            if strand_bias_fails(myData,int(c[refCol,0]),int(c[refCol,1]),int(c[col,0]),int(c[col,1])) is True:
+                asFilter.append('strand_bias')
+            else:
+                asFilter.append('SITE')
+        if 'SITE' in asFilter:
+            filt = 'PASS'
+        else:
+            filt = 'strand_bias'
+
+        info = 'DP=%i;AS_SB_TABLE=%s;AS_FilterStatus=%s' % (dp,'|'.join(sbTable),'|'.join(asFilter))
+        gt = '/'.join([str(i) for i in range(len(alts)+1)])
+        sb = '%i,%i,%i,%i' % (c[refCol,0],c[refCol,1],altF,altR)
+        geno = '%s:%s:%s:%i:%s' % (gt,','.join([str(i) for i in ad]),','.join(af),dp,sb)
+        nl = [myData['mitoContig'],str(p),'.',ref,','.join(altSeqs),'.',filt,info,'GT:AD:AF:DP:SB',geno]
+        outFile.write('\t'.join(nl) + '\n')
+        numRecords += 1
+    outFile.close()
+    return numRecords
+###################################################################################################
+def call_vars_pileup(myData):
+# call the mitochondrial variants from allele counts of both bams
+    mitoCounts,mitoIndels = count_alleles_bam(myData,myData['mitoBamSortMD'],myData['mitoLen'])
+    rotCounts,rotIndels = count_alleles_bam(myData,myData['mitoRotatedBamSortMD'],myData['mitoLen'])
+    myData['alleleCounts'],myData['alleleIndels'] = merge_allele_counts(myData,mitoCounts,mitoIndels,rotCounts,rotIndels)
+    write_merged_pileup_vcf(myData)
+###################################################################################################
+# write, compress and index mitoMerged.vcf.gz from the allele counts in myData
+def write_merged_pileup_vcf(myData):
+    myData['mitoMergeVCF'] =  myData['finalDirSample'] + 'mitoMerged.vcf'
+    refSeq = read_fasta_seq(myData['mitoFa'])
+    n = write_allele_count_vcf(myData,myData['alleleCounts'],myData['alleleIndels'],refSeq,myData['mitoMergeVCF'])
+    s = 'wrote %i pileup records to %s' % (n,myData['mitoMergeVCF'])
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+
+    # compress and tabix
+    cmd = 'bgzip%s %s' % (compress_opts(myData,'bgzip',final=True),myData['mitoMergeVCF'])
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    runCMD(cmd)
+
+    myData['mitoMergeVCF']+= '.gz'
+    cmd = 'tabix -p vcf %s' % myData['mitoMergeVCF']
+    print(cmd,flush=True)
+    myData['logFile'].write(cmd + '\n')
+    runCMD(cmd)
+    myData['logFile'].flush()
+###################################################################################################
+def save_allele_store(myData):
+# save the merged allele counts and depth so calls can be remade without the bams
+    myData['alleleStore'] = myData['finalDirSample'] + myData['sampleName'] + '.alleleCounts.npz'
+    if 'alleleCounts' not in myData:  # mutect2 run, count alleles now
+        mitoCounts,mitoIndels = count_alleles_bam(myData,myData['mitoBamSortMD'],myData['mitoLen'])
+        rotCounts,rotIndels = count_alleles_bam(myData,myData['mitoRotatedBamSortMD'],myData['mitoLen'])
+        myData['alleleCounts'],myData['alleleIndels'] = merge_allele_counts(myData,mitoCounts,mitoIndels,rotCounts,rotIndels)
+
+    depth = np.zeros(myData['mitoLen'],dtype=np.uint32)
+    inFile = open(myData['mitoMergePerBp'],'r')
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split()
+        depth[int(line[0])-1] = int(line[1])
+    inFile.close()
+
+    indelPos = []
+    indelType = []
+    indelAllele = []
+    indelCount = []
+    for k in sorted(myData['alleleIndels']):
+        for allele in myData['alleleIndels'][k]:
+            indelPos.append(k[0])
+            indelType.append(k[1])
+            indelAllele.append(str(allele))
+            indelCount.append(myData['alleleIndels'][k][allele])
+
+    np.savez_compressed(myData['alleleStore'],
+                        counts = myData['alleleCounts'],
+                        depth = depth,
+                        indelPos = np.array(indelPos,dtype=np.uint32),
+                        indelType = np.array(indelType,dtype=str),
+                        indelAllele = np.array(indelAllele,dtype=str),
+                        indelCount = np.array(indelCount,dtype=np.uint32),
+                        sampleName = np.array(myData['sampleName']),
+                        mitoContig = np.array(myData['mitoContig']),
+                        roteTake = np.array(myData['roteTake']),
+                        callEngine = np.array(myData['callEngine']))
+    s = 'saved allele counts to %s' % myData['alleleStore']
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
+###################################################################################################
+# load a store written by save_allele_store into myData
+def load_allele_store(myData,storeFileName):
+    store = np.load(storeFileName)
+    myData['alleleStore'] = storeFileName
+    myData['alleleCounts'] = store['counts']
+    myData['mergedDepth'] = store['depth']
+    myData['mitoLen'] = store['counts'].shape[0]
+    myData['mitoContig'] = str(store['mitoContig'])
+    myData['roteTake'] = int(store['roteTake'])
+    # engine that made the original calls, stores from before it was saved have none
+    myData['storeCallEngine'] = 'unknown'
+    if 'callEngine' in store.files:
+        myData['storeCallEngine'] = str(store['callEngine'])
+    if 'sampleName' not in myData:
+        myData['sampleName'] = str(store['sampleName'])
+    indels = {}
+    for i in range(len(store['indelPos'])):
+        k = (int(store['indelPos'][i]),str(store['indelType'][i]))
+        allele = str(store['indelAllele'][i])
+        if k[1] == 'DEL':
+            allele = int(allele)
+        if k not in indels:
+            indels[k] = {}
+        indels[k][allele] = int(store['indelCount'][i])
+    myData['alleleIndels'] = indels
+    store.close()
+###################################################################################################
+def recall_from_store(myData):
+# remake the merged vcf and depth file from a saved store, then rerun the
+# germline filter, consensus and haplogroup steps
+    myData['mitoMergePerBp'] =  myData['finalDirSample'] + 'mitoMerge.per-bp.txt'
+    outFile = open(myData['mitoMergePerBp'],'w')
+    for i in range(myData['mitoLen']):
+        outFile.write('%i\t%i\n' % (i+1,myData['mergedDepth'][i]))
+    outFile.close()
+
+    write_merged_pileup_vcf(myData)
+    filter_germline(myData)
+    make_fasta_germline(myData)
+    assign_haplogroup(myData)
+###################################################################################################
+# trim an allele to its minimal representation so calls from different engines compare
+def normalize_allele(pos,ref,alt):
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref = ref[:-1]
+        alt = alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref = ref[1:]
+        alt = alt[1:]
+        pos += 1
+    return (pos,ref,alt)
+###################################################################################################
+# read the germline filtered calls, returns dict of normalized allele to allele frequency
+def read_germline_calls(vcfFileName):
+    calls = {}
+    inFile = gzip.open(vcfFileName,'rt')
+    for line in inFile:
+        if line[0] == '#':
+            continue
+        rec = VCFRecord(line)
+        altIndex = int(rec.format_value('GT').split('/')[0])
+        alt = rec.field(4).split(',')[altIndex-1]
+        ad = [int(i) for i in rec.format_value('AD').split(',')]
+        if sum(ad) == 0:
+            f = 0.0
+        else:
+            f = ad[altIndex]/sum(ad)
+        calls[normalize_allele(rec.pos(),rec.field(3),alt)] = f
+    inFile.close()
+    return calls
+###################################################################################################
+def benchmark_callers(myData):
+# run the other calling engine into a subdirectory and compare germline calls
+    if myData['callEngine'] == 'pileup':
+        otherEngine = 'mutect2'
+    else:
+        otherEngine = 'pileup'
+
+    bData = SampleRun(myData)
+    bData['callEngine'] = otherEngine
+    bData['finalDirSample'] = myData['finalDirSample'] + 'caller-benchmark/'
+    if os.path.isdir(bData['finalDirSample']) is False:
+        os.mkdir(bData['finalDirSample'])
+
+    s = 'benchmark: running %s into %s' % (otherEngine,bData['finalDirSample'])
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    call_vars(bData)
+    filter_germline(bData)
+
+    primaryCalls = read_germline_calls(myData['mitoMergeVCFFilter'])
+    otherCalls = read_germline_calls(bData['mitoMergeVCFFilter'])
+    shared = [k for k in primaryCalls if k in otherCalls]
+    onlyPrimary = [k for k in primaryCalls if k not in otherCalls]
+    onlyOther = [k for k in otherCalls if k not in primaryCalls]
+    union = len(shared) + len(onlyPrimary) + len(onlyOther)
+    if union == 0:
+        concordance = 1.0
+    else:
+        concordance = len(shared)/union
+
+    myData['callerBenchmark'] = myData['finalDirSample'] + myData['sampleName'] + '.caller-benchmark.txt'
+    outFile = open(myData['callerBenchmark'],'w')
+    outFile.write('engine\t%s\t%s\n' % (myData['callEngine'],otherEngine))
+    outFile.write('callSeconds\t%.1f\t%.1f\n' % (myData['callVarsTime'],bData['callVarsTime']))
+    outFile.write('germlineCalls\t%i\t%i\n' % (len(primaryCalls),len(otherCalls)))
+    outFile.write('shared\t%i\n' % len(shared))
+    outFile.write('concordance\t%f\n' % concordance)
+    outFile.write('\n#pos\tref\talt\t%s_AF\t%s_AF\n' % (myData['callEngine'],otherEngine))
+    for k in sorted(shared + onlyPrimary + onlyOther):
+        fp = '%.3f' % primaryCalls[k] if k in primaryCalls else '.'
+        fo = '%.3f' % otherCalls[k] if k in otherCalls else '.'
+        outFile.write('%i\t%s\t%s\t%s\t%s\n' % (k[0],k[1],k[2],fp,fo))
+    outFile.close()
+
+    s = 'benchmark: %i shared, %i only %s, %i only %s, concordance %f' % (len(shared),len(onlyPrimary),myData['callEngine'],len(onlyOther),otherEngine,concordance)
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+    myData['logFile'].flush()
 ###################################################################################################
 def filter_germline(myData):
 # filter out for germline calls
@@ -772,43 +2312,14 @@ def filter_germline(myData):
         if line[0] == '#':
             outFile.write(line)
             continue
-        line = line.rstrip()
-        ol = line
-        line = line.split()
-        
-        infoDict = parse_vcf_info(line[7])
-        genoDict = parse_genotype(line[8],line[9])
-
-        
-                
-        # check num alt alleles
-        alts = line[4]
-        alts = alts.split(',')
-
-        # get dp
-        dp = genoDict['AD']
-        altIndexmaxAltAlleleFeq = 0 # is index of alleles, not of alt allels
-        maxAltAlleleFeq = 0.0
-        tot = 0
-        for i in range(len(dp)):
-            tot += int(dp[i])
-        for i in range(1,len(dp)):
-            d = int(dp[i])
-            if tot == 0:
-                f = 0.0
-            else:
-                f = d/tot
-            if f > maxAltAlleleFeq:
-                maxAltAlleleFeq = f
-                altIndexmaxAltAlleleFeq = i
-            
+        rec = VCFRecord(line)
+        altIndexmaxAltAlleleFeq,maxAltAlleleFeq,strandBias = germline_max_alt(rec)
 
         # check filters, see if max alt allele passess filters
         # only look for strand_bias as an artefact
-        AS_Filters = infoDict['AS_FilterStatus']        
-        if 'strand_bias' in AS_Filters[altIndexmaxAltAlleleFeq-1]:
+        if strandBias is True and myData['strandBiasMode'] == 'filter':
             s = 'fails strand bias,allele index is %i' % altIndexmaxAltAlleleFeq
-            s += '\n' + ol
+            s += '\n' + line.rstrip()
             print(s,flush=True)
             myData['logFile'].write(s + '\n')                                                
             continue
@@ -820,22 +2331,21 @@ def filter_germline(myData):
 
 
         
-        line[6] = 'PASS'        
+        rec.set_field(6,'PASS')
         # edit the gen
-        gen = line[9]
+        gen = rec.field(9)
         gen = gen.split(':')
         gen[0] = str(altIndexmaxAltAlleleFeq) + '/' + str(altIndexmaxAltAlleleFeq) # make it homozygous
-        line[9] = ':'.join(gen)
+        rec.set_field(9,':'.join(gen))
         
-        nl = '\t'.join(line) + '\n'
-        outFile.write(nl)
+        outFile.write(rec.to_line())
             
     inFile.close()
     outFile.close()  
     # convert to gz
     outStats.close()
 
-    cmd = 'bgzip %s' % myData['mitoMergeVCFFilter']
+    cmd = 'bgzip%s %s' % (compress_opts(myData,'bgzip',final=True),myData['mitoMergeVCFFilter'])
     print(cmd,flush=True)
     myData['logFile'].write(cmd + '\n')              
     runCMD(cmd)
@@ -849,9 +2359,35 @@ def filter_germline(myData):
     myData['logFile'].flush()    
     
     
+###################################################################################################
+# the alt allele with the highest read fraction, returns [allele index, fraction,
+# True if that allele fails strand bias]
+def germline_max_alt(rec):
+    # get dp
+    dp = rec.format_value('AD').split(',')
+    altIndexmaxAltAlleleFeq = 0 # is index of alleles, not of alt allels
+    maxAltAlleleFeq = 0.0
+    tot = 0
+    for i in range(len(dp)):
+        tot += int(dp[i])
+    for i in range(1,len(dp)):
+        d = int(dp[i])
+        if tot == 0:
+            f = 0.0
+        else:
+            f = d/tot
+        if f > maxAltAlleleFeq:
+            maxAltAlleleFeq = f
+            altIndexmaxAltAlleleFeq = i
+    AS_Filters = rec.info('AS_FilterStatus').split('|')
+    strandBias = 'strand_bias' in AS_Filters[altIndexmaxAltAlleleFeq-1]
+    return [altIndexmaxAltAlleleFeq,maxAltAlleleFeq,strandBias]
+###################################################################################################
+# regions always masked in the fasta, bed coordinates
+fixedMaskRegions = [[15989,16600],[15511,15535]]
 ###################################################################################################
 def make_fasta_germline(myData):
-    minMitoDepth = 3
+    minMitoDepth = myData['minMitoDepth']
     myData['mitoMergeMasked'] =  myData['finalDirSample'] + 'mask-regions.bed'
     myData['mitoMergeFasta'] = myData['finalDirSample'] + myData['sampleName'] + '.fa'
     
@@ -861,8 +2397,8 @@ def make_fasta_germline(myData):
     # first setup regions to mask, includes hard coded regions
     # and any region with depth < 100
     outFile = open(myData['mitoMergeMasked'],'w')
-    outFile.write('NC_002008.4\t15989\t16600\n')
-    outFile.write('NC_002008.4\t15511\t15535\n')    
+    for r in fixedMaskRegions:
+        outFile.write('NC_002008.4\t%i\t%i\n' % (r[0],r[1]))
 
     
     alreadyMasked = {}
@@ -899,10 +2435,9 @@ def make_fasta_germline(myData):
     for line in inFile:
         if line[0] == '#':
             continue
-        line = line.rstrip()
-        line = line.split()
-        pos = int(line[1])
-        ref = line[3]
+        rec = VCFRecord(line)
+        pos = rec.pos()
+        ref = rec.field(3)
         refLen = len(ref)
         posEnd = pos+refLen - 1
         
@@ -941,6 +2476,7 @@ def make_fasta_germline(myData):
             outFile.write(line)
     inFile.close()
     outFile.close()      
+    remove_intermediates(myData,[tmpFa])
     myData['logFile'].flush()    
       
 #############################################################################    
@@ -948,29 +2484,8 @@ def assign_haplogroup(myData):
     # read in diagnostic table
     myData['mitoMergeHaploGroup'] = myData['finalDirSample'] + myData['sampleName'] + '.haplogroup.txt'
     
-    inFile = open(myData['diagnosticTable'],'r')
-    haplos = []
-    for line in inFile:
-        line = line.rstrip()
-        line = line.split('\t')
-        
-        if line[0] == '#Haplogroup':
-            header = line
-        elif line[0] == '#haplogroup':
-            break
-        else:
-            haplos.append(line)        
-    definedHaps = []
-    haploGroupOrder = line[1:]
-    for line in inFile:
-        line = line.rstrip()
-        line = line.split('\t')
-        hapName = line[0]
-        hapSeq = line[1:]
-        definedHaps.append([hapName,hapSeq])
-
+    haplos,haploGroupOrder,definedHaps = read_diagnostic_table(myData['diagnosticTable'])
     print('read in the hap seqs!',len(definedHaps))
-    inFile.close()
        
     # read in all the SNPs
     inFile = gzip.open(myData['mitoMergeVCFFilter'],'rt')
@@ -978,12 +2493,11 @@ def assign_haplogroup(myData):
     for line in inFile:
         if line[0] == '#':
              continue
-        line = line.rstrip()
-        line = line.split()
+        rec = VCFRecord(line)
         
-        pos = line[1]
-        ref = line[3]
-        alt = line[4]
+        pos = rec.field(1)
+        ref = rec.field(3)
+        alt = rec.field(4)
         i = ref + '-' + pos + '-' + alt
         snps[i] = 1
     inFile.close()
@@ -992,14 +2506,12 @@ def assign_haplogroup(myData):
     outFile = open(myData['mitoMergeHaploGroup'],'w')
     outFile.write('#Haplogroup\tNumber of SNPs\tSNPs\tNumber Present\n')
     
-    pToSNPrecord = {}
+    pToSNPrecord = diagnostic_snp_records(haplos)
     outputRows = []
     for hap in haplos:
         numFound = 0
         hapSnp = hap[2].split(';')
         for h in hapSnp:
-            p = h.split('-')[1]
-            pToSNPrecord[p] = h
             if h in snps:
                 numFound += 1
         # print them all out I suppose..
@@ -1012,20 +2524,72 @@ def assign_haplogroup(myData):
     
     # now need to make the hap seq to compare with....
     
+    sampleSeq = sample_haplotype(snps,haploGroupOrder,pToSNPrecord)
+    print(sampleSeq)
+    
+    nl = ''.join(sampleSeq)
+    outFile.write('\n#Haplotype Assignment\nsample haplotype:\t%s\n' % nl)
+    
+    # now need to go through and figure out the ones with the closest match
+    dists = haplogroup_distances(sampleSeq,definedHaps)
+    print(dists)
+    
+    matches = best_haplogroups(dists)
+    if len(matches) == 1:
+        outFile.write('Best match:\t%s\tNum differences:\t%i\n' % (matches[0][1],matches[0][0]))
+    else:
+        for d in matches:
+            outFile.write('Tied match:\t%s\tNum differences:\t%i\n' % (d[1],d[0]))    
+    outFile.close()
+#############################################################################
+# reads the diagnostic table, returns [haplogroup SNP rows, order of the positions in
+# the haplotypes, [name,haplotype] of each defined haplogroup]
+def read_diagnostic_table(tableFileName):
+    inFile = open(tableFileName,'r')
+    haplos = []
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split('\t')
+        
+        if line[0] == '#Haplogroup':
+            header = line
+        elif line[0] == '#haplogroup':
+            break
+        else:
+            haplos.append(line)        
+    definedHaps = []
+    haploGroupOrder = line[1:]
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split('\t')
+        hapName = line[0]
+        hapSeq = line[1:]
+        definedHaps.append([hapName,hapSeq])
+    inFile.close()
+    return [haplos,haploGroupOrder,definedHaps]
+#############################################################################
+# position (as a string) to REF-POS-ALT of each diagnostic SNP
+def diagnostic_snp_records(haplos):
+    pToSNPrecord = {}
+    for hap in haplos:
+        for h in hap[2].split(';'):
+            p = h.split('-')[1]
+            pToSNPrecord[p] = h
+    return pToSNPrecord
+#############################################################################
+# alleles of the sample at the diagnostic positions, snps has REF-POS-ALT keys of the calls
+def sample_haplotype(snps,haploGroupOrder,pToSNPrecord):
     sampleSeq = []
     for p in haploGroupOrder:
-        print(p,pToSNPrecord[p])
         if pToSNPrecord[p] in snps:
             allele = pToSNPrecord[p].split('-')[2]
         else:
             allele = pToSNPrecord[p].split('-')[0]
         sampleSeq.append(allele)
-    print(sampleSeq)
-    
-    nl = ''.join(sampleSeq)
-    outFile.write('\n#Haplotype Assignment\nsample haplotype:\t%s\n' % nl)
-    
-    # now need to go through and figure out the ones with the closest match
+    return sampleSeq
+#############################################################################
+# [number of differences,name] to each defined haplogroup, closest first
+def haplogroup_distances(sampleSeq,definedHaps):
     dists = []
     for defHaps in definedHaps:
         hapName =defHaps[0]
@@ -1033,22 +2597,83 @@ def assign_haplogroup(myData):
         
         numDiff = 0
         for i in range(len(hapSeq)):
+            if sampleSeq[i] == 'N': # not genotyped
+                continue
             if hapSeq[i] != sampleSeq[i]:
                 numDiff += 1
         dists.append([numDiff,hapName])
             
     # now need to sort
     dists.sort(key=lambda i: i[0])
-    print(dists)
-    
+    return dists
+#############################################################################
+# the best match, or all tied matches, from haplogroup_distances
+def best_haplogroups(dists):
     if dists[0][0] < dists[1][0]:
-        outFile.write('Best match:\t%s\tNum differences:\t%i\n' % (dists[0][1],dists[0][0]))
-    else:
-        for d in dists:
-            if d[0] > dists[0][0]:
-                continue
-            outFile.write('Tied match:\t%s\tNum differences:\t%i\n' % (d[1],d[0]))    
-    outFile.close()
+        return [dists[0]]
+    return [d for d in dists if d[0] == dists[0][0]]
+#############################################################################
+# a vcf data line that is only split as far as the fields asked for, and
+# where INFO and FORMAT values are only decoded for the keys asked for
+class VCFRecord:
+    __slots__ = ['line','fields','fullSplit']
+
+    def __init__(self,line):
+        self.line = line.rstrip('\n')
+        self.fields = None
+        self.fullSplit = False
+
+    # returns the string in column i, 0 based
+    def field(self,i):
+        if i < 5:
+            if self.fields is None:
+                self.fields = self.line.split('\t',5)
+        elif self.fullSplit is False:
+            self.fields = self.line.split('\t')
+            self.fullSplit = True
+        return self.fields[i]
+
+    def set_field(self,i,val):
+        self.field(9)
+        self.fields[i] = val
+
+    def pos(self):
+        return int(self.field(1))
+
+    # value of an INFO key as a string, '' for a flag and None if not present
+    def info(self,key):
+        infoField = self.field(7)
+        start = 0
+        while True:
+            i = infoField.find(key,start)
+            if i == -1:
+                return None
+            end = i + len(key)
+            if i == 0 or infoField[i-1] == ';':
+                if end == len(infoField) or infoField[end] == ';':
+                    return ''
+                if infoField[end] == '=':
+                    j = infoField.find(';',end)
+                    if j == -1:
+                        j = len(infoField)
+                    return infoField[end+1:j]
+            start = end
+
+    # value of a FORMAT key for the first sample, None if not present
+    def format_value(self,key):
+        formats = self.field(8).split(':')
+        if key not in formats:
+            return None
+        k = formats.index(key)
+        vals = self.field(9).split(':',k+1)
+        if k >= len(vals):
+            return None
+        return vals[k]
+
+    def to_line(self):
+        if self.fullSplit is True:
+            return '\t'.join(self.fields) + '\n'
+        return self.line + '\n'
 #############################################################################    
 # Makes a dictionary of the info field in a vcf file
 # returns the dictionary
@@ -1089,3 +2714,583 @@ def parse_genotype(formatField,genoTypeField):
 
 
 
+# k-mer prefilter of raw fastq, keeps reads sharing k-mers with the mito (and optional numts)
+# so that only candidate reads are aligned with bwa aln
+###############################################################################
+# adds all k-mers of seq and its reverse complement that have no ambiguous bases
+def add_seq_kmers(kmers,seq,k):
+    seq = seq.upper()
+    for s in [seq,revcomp(seq)]:
+        for i in range(len(s)-k+1):
+            kmer = s[i:i+k]
+            if kmer.strip('ACGT') == '':
+                kmers.add(kmer)
+###############################################################################
+# sequences of bed intervals from an indexed genome fasta
+def read_bed_seqs(refFa,bedFileName):
+    seqs = []
+    inFile = open(bedFileName,'r')
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split()
+        if len(line) < 3 or line[0][0] == '#':
+            continue
+        cmd = 'samtools faidx %s %s:%i-%i' % (refFa,line[0],int(line[1])+1,int(line[2]))
+        out = runCMD_output(cmd)
+        seqs.append(''.join([l.strip() for l in out if len(l) > 0 and l[0] != '>']))
+    inFile.close()
+    return seqs
+###############################################################################
+def build_prefilter_kmers(myData):
+    kmers = set()
+    for faFileName in [myData['mitoFa'],myData['mitoFaRotated']]:
+        add_seq_kmers(kmers,read_fasta_seq(faFileName),myData['kmerSize'])
+    numMito = len(kmers)
+    if myData['numtBed'] is not None:
+        for seq in read_bed_seqs(myData['ref'],myData['numtBed']):
+            add_seq_kmers(kmers,seq,myData['kmerSize'])
+    print('prefilter index has %i mito and %i numt k-mers' % (numMito,len(kmers)-numMito),flush=True)
+    return kmers
+###############################################################################
+# the k-mer set is shared with each worker once, not with every chunk
+def init_prefilter_worker(kmers,k,minKmers):
+    global prefilterKmers,prefilterK,prefilterMinKmers
+    prefilterKmers = kmers
+    prefilterK = k
+    prefilterMinKmers = minKmers
+###############################################################################
+# True if the read sequence has at least minKmers k-mers in the set
+def read_has_kmers(seq,kmers,k,minKmers):
+    hits = 0
+    for i in range(len(seq)-k+1):
+        if seq[i:i+k] in kmers:
+            hits += 1
+            if hits >= minKmers:
+                return True
+    return False
+###############################################################################
+# chunk is a list of fastq lines, returns the kept records as one string
+def prefilter_chunk(chunk):
+    kept = []
+    for i in range(0,len(chunk)-3,4):
+        if read_has_kmers(chunk[i+1].rstrip().upper(),prefilterKmers,prefilterK,prefilterMinKmers) is True:
+            kept.append(''.join(chunk[i:i+4]))
+    return [len(chunk)//4,''.join(kept)]
+###############################################################################
+# yields lists of chunkSize fastq records (4 lines each)
+def read_fastq_chunks(inFile,chunkSize):
+    chunk = []
+    for line in inFile:
+        chunk.append(line)
+        if len(chunk) == 4 * chunkSize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        if len(chunk) % 4 != 0:
+            raise CallmitoError('truncated fastq record at end of input')
+        yield chunk
+###############################################################################
+# streams the input fastq files through the prefilter workers, output keeps the input order
+def prefilter_fastq(myData):
+    kmers = build_prefilter_kmers(myData)
+    writer = open_bgzip_writer(myData,myData['outFastq'],final=True)
+    numIn = 0
+    numKept = 0
+    pool = multiprocessing.Pool(myData['threads'],initializer=init_prefilter_worker,
+                                initargs=(kmers,myData['kmerSize'],myData['minKmers']))
+    for fqFileName in myData['inFastqs']:
+        # decompress in a separate process so the main process only splits lines
+        cmd = 'bgzip -dc -@ 2 %s' % fqFileName
+        if fqFileName.endswith('.gz') is False:
+            cmd = 'cat %s' % fqFileName
+        print(cmd,flush=True)
+        proc = subprocess.Popen(cmd, universal_newlines=True, shell=True, stdout = subprocess.PIPE)
+        for n,kept in pool.imap(prefilter_chunk,read_fastq_chunks(proc.stdout,myData['chunkSize'])):
+            numIn += n
+            numKept += kept.count('\n') // 4
+            writer.stdin.write(kept)
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise CallmitoError('command failed: %s' % cmd)
+    pool.close()
+    pool.join()
+    close_bgzip_writer(writer)
+    if numIn == 0:
+        f = 0.0
+    else:
+        f = numKept / numIn
+    print('prefilter kept %i of %i reads (%f)' % (numKept,numIn,f),flush=True)
+    return [numIn,numKept]
+###############################################################################
+# sqlite results store for cohort queries, filled after each run or by import-results.py
+###############################################################################
+resultsDBSchema = """
+CREATE TABLE IF NOT EXISTS samples (sample TEXT PRIMARY KEY, sampleDir TEXT, signature TEXT, imported TEXT,
+    meanDepth REAL, medDepth REAL, minDepth REAL, maxDepth REAL,
+    haplogroup TEXT, haplogroupDiffs INTEGER, haplogroupTied INTEGER);
+CREATE TABLE IF NOT EXISTS variants (sample TEXT, pos INTEGER, ref TEXT, alt TEXT, af REAL, depth INTEGER);
+CREATE TABLE IF NOT EXISTS metrics (sample TEXT, name TEXT, value REAL);
+CREATE TABLE IF NOT EXISTS stage_times (sample TEXT, stage TEXT, seconds REAL);
+CREATE INDEX IF NOT EXISTS variantsSample ON variants (sample);
+CREATE INDEX IF NOT EXISTS variantsPos ON variants (pos,ref,alt);
+CREATE INDEX IF NOT EXISTS metricsSample ON metrics (sample,name);
+CREATE INDEX IF NOT EXISTS stageTimesSample ON stage_times (sample);
+CREATE INDEX IF NOT EXISTS samplesHaplogroup ON samples (haplogroup);
+"""
+# picard metrics files loaded into the metrics table, name prefix and file name
+resultsPicardFiles = [['mito.dup','mito.dup_metrics.txt'],['mitoRotated.dup','mitoRotated.dup_metrics.txt'],
+                      ['mito.hsmets','mito.hsmets.txt'],['mitoRotated.hsmets','mitoRotated.hsmets.txt']]
+###############################################################################
+# WAL lets runs finishing at the same time wait on the lock instead of failing
+def open_results_db(dbFileName):
+    db = sqlite3.connect(dbFileName,timeout=600)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(resultsDBSchema)
+    return db
+###############################################################################
+# output files of a sample that are loaded into the store
+def sample_result_files(sampleDir,sampleName):
+    files = {}
+    files['perBpStats'] = sampleDir + 'mitoMerge.per-bp.stats'
+    files['nonRefFraction'] = sampleDir + sampleName + '.nonRefFraction.txt'
+    files['germlineVCF'] = sampleDir + sampleName + '.mitoMerged.germline.filter.vcf.gz'
+    files['haplogroup'] = sampleDir + sampleName + '.haplogroup.txt'
+    files['stageTimes'] = sampleDir + sampleName + '.stage-times.txt'
+    for r in resultsPicardFiles:
+        files[r[0]] = sampleDir + r[1]
+    return files
+###############################################################################
+# size and mtime of each output, so unchanged samples are skipped on re-import
+def result_files_signature(files):
+    sig = hashlib.sha1()
+    for k in sorted(files.keys()):
+        if os.path.isfile(files[k]) is False:
+            sig.update(('%s\tmissing\n' % k).encode())
+            continue
+        st = os.stat(files[k])
+        sig.update(('%s\t%i\t%i\n' % (k,st.st_size,st.st_mtime_ns)).encode())
+    return sig.hexdigest()
+###############################################################################
+# first metrics row of a picard metrics file, numeric values only
+def read_picard_metrics(fileName):
+    metrics = {}
+    inFile = open(fileName,'r')
+    lines = [line.rstrip('\n') for line in inFile]
+    inFile.close()
+    for i in range(len(lines)-2):
+        if lines[i].startswith('## METRICS CLASS'):
+            header = lines[i+1].split('\t')
+            vals = lines[i+2].split('\t')
+            for j in range(min(len(header),len(vals))):
+                try:
+                    metrics[header[j]] = float(vals[j])
+                except ValueError:
+                    pass
+            break
+    return metrics
+###############################################################################
+# best or tied haplogroup matches from the haplogroup report
+def read_haplogroup_matches(fileName):
+    matches = []
+    diffs = None
+    inFile = open(fileName,'r')
+    for line in inFile:
+        line = line.rstrip()
+        if line.startswith('Best match:') or line.startswith('Tied match:'):
+            line = line.split('\t')
+            matches.append(line[1])
+            diffs = int(line[3])
+    inFile.close()
+    matches.sort()
+    return [matches,diffs]
+###############################################################################
+# germline calls with allele frequency and depth, alleles are normalized
+def read_germline_variants(vcfFileName):
+    variants = []
+    inFile = gzip.open(vcfFileName,'rt')
+    for line in inFile:
+        if line[0] == '#':
+            continue
+        rec = VCFRecord(line)
+        altIndex = int(rec.format_value('GT').split('/')[0])
+        alt = rec.field(4).split(',')[altIndex-1]
+        ad = [int(i) for i in rec.format_value('AD').split(',')]
+        if sum(ad) == 0:
+            f = 0.0
+        else:
+            f = ad[altIndex]/sum(ad)
+        pos,ref,alt = normalize_allele(rec.pos(),rec.field(3),alt)
+        variants.append([pos,ref,alt,f,sum(ad)])
+    inFile.close()
+    return variants
+###############################################################################
+# upserts one sample, returns False if its outputs are unchanged since the last import
+def import_sample_results(db,sampleDir,sampleName,force=False):
+    sampleDir = os.path.abspath(sampleDir) + '/'
+    files = sample_result_files(sampleDir,sampleName)
+    sig = result_files_signature(files)
+    row = db.execute('SELECT signature FROM samples WHERE sample = ?',(sampleName,)).fetchone()
+    if force is False and row is not None and row[0] == sig:
+        return False
+
+    depth = {'meanDepth':None,'medDepth':None,'minDepth':None,'maxDepth':None}
+    if os.path.isfile(files['perBpStats']) is True:
+        inFile = open(files['perBpStats'],'r')
+        for line in inFile:
+            line = line.rstrip()
+            line = line.split('\t')
+            depth[line[0]] = float(line[1])
+        inFile.close()
+
+    metrics = []
+    for r in resultsPicardFiles:
+        if os.path.isfile(files[r[0]]) is True:
+            m = read_picard_metrics(files[r[0]])
+            for k in m:
+                metrics.append([r[0] + '.' + k,m[k]])
+    if os.path.isfile(files['nonRefFraction']) is True:
+        inFile = open(files['nonRefFraction'],'r')
+        fracs = [float(line) for line in inFile if line.strip() != '']
+        inFile.close()
+        metrics.append(['nonRefFraction.sites',len(fracs)])
+        metrics.append(['nonRefFraction.intermediate',len([f for f in fracs if f >= 0.1 and f <= 0.9])])
+
+    haps = [[],None]
+    if os.path.isfile(files['haplogroup']) is True:
+        haps = read_haplogroup_matches(files['haplogroup'])
+
+    variants = []
+    if os.path.isfile(files['germlineVCF']) is True:
+        variants = read_germline_variants(files['germlineVCF'])
+
+    stageTimes = []
+    if os.path.isfile(files['stageTimes']) is True:
+        inFile = open(files['stageTimes'],'r')
+        for line in inFile:
+            if line[0] == '#':
+                continue
+            line = line.rstrip()
+            line = line.split('\t')
+            stageTimes.append([line[0],float(line[1])])
+        inFile.close()
+
+    imported = time.strftime('%Y-%m-%d %H:%M:%S',time.localtime())
+    with db:
+        for table in ['variants','metrics','stage_times']:
+            db.execute('DELETE FROM %s WHERE sample = ?' % table,(sampleName,))
+        db.execute('INSERT OR REPLACE INTO samples VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                   (sampleName,sampleDir,sig,imported,depth['meanDepth'],depth['medDepth'],depth['minDepth'],
+                    depth['maxDepth'],','.join(haps[0]),haps[1],int(len(haps[0]) > 1)))
+        db.executemany('INSERT INTO variants VALUES (?,?,?,?,?,?)',[[sampleName] + v for v in variants])
+        db.executemany('INSERT INTO metrics VALUES (?,?,?)',[[sampleName] + m for m in metrics])
+        db.executemany('INSERT INTO stage_times VALUES (?,?,?)',[[sampleName] + st for st in stageTimes])
+    return True
+###############################################################################
+# add this run to the results store, after any stage out so the final dir is recorded
+def update_results_db(myData):
+    sampleDir = myData['finalDirSample']
+    if myData['scratchDir'] is not None:
+        sampleDir = myData['outDirSample']
+    db = open_results_db(myData['resultsDB'])
+    import_sample_results(db,sampleDir,myData['sampleName'],force=True)
+    db.close()
+    print('added %s to results db %s' % (myData['sampleName'],myData['resultsDB']),flush=True)
+###############################################################################
+# germline threshold sweep, each sample's merged vcf and depth track are read once and
+# the whole grid of minAlleleFreq, minMitoDepth and strand bias mode is evaluated with numpy
+###############################################################################
+# grid is {'minAlleleFreq':[...],'minMitoDepth':[...],'strandBiasMode':[...]} and
+# diag is the read_diagnostic_table result, returns a dict of arrays indexed
+# [minAlleleFreq,minMitoDepth,strandBiasMode] and the haplogroup of each setting
+def sweep_sample(sampleDir,grid,diag):
+    # sites as filter_germline sees them, in file order as make_fasta_germline does
+    pos = []
+    refLen = []
+    maxAF = []
+    strandBias = []
+    snpKeys = []
+    inFile = gzip.open(sampleDir + 'mitoMerged.vcf.gz','rt')
+    for line in inFile:
+        if line[0] == '#':
+            continue
+        rec = VCFRecord(line)
+        altIndex,f,sb = germline_max_alt(rec)
+        pos.append(rec.pos())
+        refLen.append(len(rec.field(3)))
+        maxAF.append(f)
+        strandBias.append(sb)
+        snpKeys.append(rec.field(3) + '-' + rec.field(1) + '-' + rec.field(4))
+    inFile.close()
+    pos = np.array(pos,dtype=np.int64)
+    posEnd = pos + np.array(refLen,dtype=np.int64) - 1
+    maxAF = np.array(maxAF,dtype=np.float64)
+    strandBias = np.array(strandBias,dtype=bool)
+
+    depth = np.loadtxt(sampleDir + 'mitoMerge.per-bp.txt',dtype=np.int64,ndmin=2)
+    seqLen = int(depth[:,0].max())
+    depthByPos = np.zeros(seqLen+1,dtype=np.int64)
+    depthByPos[depth[:,0]] = depth[:,1]
+
+    # [af,mode,site] calls that pass, [depth,pos] masked by the fixed regions or low depth
+    afs = np.array(grid['minAlleleFreq'],dtype=np.float64)
+    ignoreSB = np.array([m == 'ignore' for m in grid['strandBiasMode']],dtype=bool)
+    passed = (maxAF[None,None,:] >= afs[:,None,None]) & (~strandBias[None,None,:] | ignoreSB[None,:,None])
+    fixedMask = np.zeros(seqLen+1,dtype=bool)
+    for r in fixedMaskRegions:
+        fixedMask[r[0]+1:r[1]+1] = True
+    depthMask = fixedMask[None,:] | (depthByPos[None,:] < np.array(grid['minMitoDepth'],dtype=np.int64)[:,None])
+    depthMask[:,0] = False
+
+    haplos,haploGroupOrder,definedHaps = diag
+    pToSNPrecord = diagnostic_snp_records(haplos)
+
+    numA = len(afs)
+    numD = len(grid['minMitoDepth'])
+    numS = len(ignoreSB)
+    res = {}
+    res['calls'] = np.zeros((numA,numD,numS),dtype=np.int64)
+    res['maskedBases'] = np.zeros((numA,numD,numS),dtype=np.int64)
+    res['haplogroup'] = np.empty((numA,numD,numS),dtype=object)
+    for a in range(numA):
+        for m in range(numS):
+            idx = np.nonzero(passed[a,m])[0]
+            # consecutive kept records that overlap are masked, as in make_fasta_germline
+            overlapMask = np.zeros(seqLen+1,dtype=bool)
+            p = pos[idx]
+            e = posEnd[idx]
+            hits = np.nonzero((p[1:] <= e[:-1]) & (p[1:] >= p[:-1]))[0]
+            for j in hits:
+                overlapMask[p[j]:e[j]+1] = True
+                overlapMask[p[j+1]:e[j+1]+1] = True
+            res['calls'][a,:,m] = len(idx)
+            res['maskedBases'][a,:,m] = (depthMask | overlapMask[None,:]).sum(axis=1)
+
+            snps = {}
+            for i in idx:
+                snps[snpKeys[i]] = 1
+            sampleSeq = sample_haplotype(snps,haploGroupOrder,pToSNPrecord)
+            matches = best_haplogroups(haplogroup_distances(sampleSeq,definedHaps))
+            hap = ','.join(sorted([d[1] for d in matches]))
+            for d in range(numD):
+                res['haplogroup'][a,d,m] = hap
+    return res
+###############################################################################
+# for multiprocessing, args is [sampleName,sampleDir,grid,diag]
+def sweep_sample_worker(args):
+    return [args[0],sweep_sample(args[1],args[2],args[3])]
+###############################################################################
+# haplogroup triage, genotypes only the diagnostic positions in reads already aligned
+# to the combined standard and rotated mito
+###############################################################################
+def triage_haplogroup(myData):
+    myData['triageHaploGroup'] = myData['finalDirSample'] + myData['sampleName'] + '.triage.haplogroup.txt'
+    haplos,haploGroupOrder,definedHaps = read_diagnostic_table(myData['diagnosticTable'])
+    pToSNPrecord = diagnostic_snp_records(haplos)
+
+    # the two contigs of mito-both.fa are copies of the same genome, so bwa places each read
+    # on one of them at random, the counts at a site are the sum of its standard position
+    # and its lifted position on the rotated contig
+    rotToOrig = read_chain_map(myData['chainFile'])
+    origToRot = np.zeros(myData['mitoLen']+1,dtype=np.int64)
+    origToRot[rotToOrig[rotToOrig > 0]] = np.nonzero(rotToOrig > 0)[0]
+    sites = []
+    for p in haploGroupOrder:
+        pos = int(p)
+        sites.append([p,pos,int(origToRot[pos])])
+
+    regions = ['%s:%i-%i' % (myData['mitoContig'],site[1],site[1]) for site in sites]
+    mitoCounts = count_alleles_bam(myData,myData['cramFileName'],myData['mitoLen'],regions)[0]
+    regions = ['%s:%i-%i' % (myData['mitoRotatedContig'],site[2],site[2]) for site in sites if site[2] != 0]
+    rotCounts = np.zeros_like(mitoCounts)
+    if len(regions) > 0:
+        rotCounts = count_alleles_bam(myData,myData['cramFileName'],myData['mitoLen'],regions)[0]
+
+    # call the major base where there is enough depth, N otherwise
+    sampleSeq = []
+    snps = {}
+    siteRows = []
+    for site in sites:
+        c = mitoCounts[site[1]-1,0:4,:].sum(axis=1)
+        if site[2] != 0:
+            c = c + rotCounts[site[2]-1,0:4,:].sum(axis=1)
+        depth = int(c.sum())
+        snp = pToSNPrecord[site[0]]
+        ref,pos,alt = snp.split('-')
+        call = 'N'
+        if depth >= myData['triageMinDepth'] and c.max() >= myData['minAlleleFreq'] * depth:
+            call = alleleCols[int(c.argmax())]
+        if call == alt:
+            snps[snp] = 1
+        sampleSeq.append(call)
+        siteRows.append([site[0],snp,site[1],site[2],depth,c,call])
+    numCalled = len([a for a in sampleSeq if a != 'N'])
+    s = 'genotyped %i of %i diagnostic sites' % (numCalled,len(sampleSeq))
+    print(s,flush=True)
+    myData['logFile'].write(s + '\n')
+
+    outFile = open(myData['triageHaploGroup'],'w')
+    outFile.write('#Haplogroup\tNumber of SNPs\tSNPs\tNumber Present\n')
+    for hap in haplos:
+        numFound = len([h for h in hap[2].split(';') if h in snps])
+        if numFound > 0:
+            outFile.write('\t'.join(hap + [str(numFound)]) + '\n')
+
+    outFile.write('\n#Haplotype Assignment\nsample haplotype:\t%s\n' % ''.join(sampleSeq))
+    if numCalled == 0:
+        outFile.write('No match:\tno diagnostic sites genotyped\n')
+    else:
+        dists = haplogroup_distances(sampleSeq,definedHaps)
+        matches = best_haplogroups(dists)
+        if len(matches) == 1:
+            outFile.write('Best match:\t%s\tNum differences:\t%i\n' % (matches[0][1],matches[0][0]))
+        else:
+            for d in matches:
+                outFile.write('Tied match:\t%s\tNum differences:\t%i\n' % (d[1],d[0]))
+
+    outFile.write('\n#Diagnostic sites, %i of %i genotyped with depth >= %i\n' % (numCalled,len(sampleSeq),myData['triageMinDepth']))
+    outFile.write('#pos\tSNP\trotatedPos\tdepth\tA\tC\tG\tT\tcall\n')
+    for r in siteRows:
+        outFile.write('%s\t%s\t%i\t%i\t%i\t%i\t%i\t%i\t%s\n' % (r[0],r[1],r[3],r[4],r[5][0],r[5][1],r[5][2],r[5][3],r[6]))
+    outFile.close()
+    myData['logFile'].flush()
+###############################################################################
+# cohort depth store, a samples x positions uint32 matrix in a raw file that is read with
+# np.memmap. samples.txt has the sample of each row, rows are written before their name
+# so readers never see a name without its row. Appends hold an flock on the lock file.
+###############################################################################
+def read_merged_depth(perBpFileName):
+    depth = np.loadtxt(perBpFileName,dtype=np.int64,ndmin=2)
+    d = np.zeros(int(depth[:,0].max()),dtype=np.uint32)
+    d[depth[:,0]-1] = depth[:,1]
+    return d
+###############################################################################
+def read_cohort_samples(storeDir):
+    names = []
+    if os.path.isfile(storeDir + 'samples.txt') is True:
+        inFile = open(storeDir + 'samples.txt','r')
+        names = [line.rstrip('\n') for line in inFile if line.strip() != '']
+        inFile.close()
+    return names
+###############################################################################
+# adds or replaces the depth row of a sample
+def append_cohort_depth(storeDir,sampleName,depth):
+    if storeDir[-1] != '/':
+        storeDir += '/'
+    if os.path.isdir(storeDir) is False:
+        os.makedirs(storeDir,exist_ok=True)
+    depth = np.ascontiguousarray(depth,dtype=np.uint32)
+    lockFile = open(storeDir + 'lock','w')
+    fcntl.flock(lockFile,fcntl.LOCK_EX)
+    try:
+        if os.path.isfile(storeDir + 'store.json') is False:
+            outFile = open(storeDir + 'store.json','w')
+            json.dump({'seqLen':len(depth),'dtype':'uint32'},outFile)
+            outFile.close()
+        inFile = open(storeDir + 'store.json','r')
+        seqLen = json.load(inFile)['seqLen']
+        inFile.close()
+        if len(depth) != seqLen:
+            raise CallmitoError('depth of %s has %i positions, store %s has %i' % (sampleName,len(depth),storeDir,seqLen))
+
+        names = read_cohort_samples(storeDir)
+        rowBytes = seqLen * 4
+        if sampleName in names:
+            dataFile = open(storeDir + 'depth.u32','r+b')
+            dataFile.seek(names.index(sampleName) * rowBytes)
+        else:
+            dataFile = open(storeDir + 'depth.u32','ab')
+            # drop a partial row left by an interrupted append
+            dataFile.truncate(len(names) * rowBytes)
+            dataFile.seek(len(names) * rowBytes)
+        dataFile.write(depth.tobytes())
+        dataFile.flush()
+        os.fsync(dataFile.fileno())
+        dataFile.close()
+        if sampleName not in names:
+            outFile = open(storeDir + 'samples.txt','a')
+            outFile.write(sampleName + '\n')
+            outFile.close()
+    finally:
+        fcntl.flock(lockFile,fcntl.LOCK_UN)
+        lockFile.close()
+###############################################################################
+# returns [sample names, read only memmap of shape (samples,positions)]
+def open_cohort_depth(storeDir):
+    if storeDir[-1] != '/':
+        storeDir += '/'
+    inFile = open(storeDir + 'store.json','r')
+    seqLen = json.load(inFile)['seqLen']
+    inFile.close()
+    names = read_cohort_samples(storeDir)
+    if len(names) == 0:
+        return [names,np.zeros((0,seqLen),dtype=np.uint32)]
+    mat = np.memmap(storeDir + 'depth.u32',dtype=np.uint32,mode='r',shape=(len(names),seqLen))
+    return [names,mat]
+###############################################################################
+def add_to_cohort_depth(myData):
+    sampleDir = myData['finalDirSample']
+    if myData['scratchDir'] is not None:
+        sampleDir = myData['outDirSample']
+    depth = read_merged_depth(sampleDir + 'mitoMerge.per-bp.txt')
+    append_cohort_depth(myData['cohortDepth'],myData['sampleName'],depth)
+    print('added %s to cohort depth store %s' % (myData['sampleName'],myData['cohortDepth']),flush=True)
+###############################################################################
+# percentiles across samples at each position, columns are done in blocks to bound memory
+def cohort_depth_percentiles(mat,percentiles,blockSize=1024):
+    res = np.zeros((len(percentiles),mat.shape[1]),dtype=np.float64)
+    for start in range(0,mat.shape[1],blockSize):
+        res[:,start:start+blockSize] = np.percentile(mat[:,start:start+blockSize],percentiles,axis=0)
+    return res
+###############################################################################
+# runs of at least minLen positions with values below maxValue, 1-based [start,end]
+def low_value_runs(values,maxValue,minLen):
+    low = np.concatenate([[False],values < maxValue,[False]])
+    edges = np.flatnonzero(low[1:] != low[:-1])
+    starts = edges[0::2] + 1
+    ends = edges[1::2]
+    keep = (ends - starts + 1) >= minLen
+    return np.stack([starts[keep],ends[keep]],axis=1)
+###############################################################################
+# per-sample depth profile scores. The expected depth of a sample is its median times
+# the cohort median profile, the log2 ratio of depth to expected (with one read added to
+# both) gives the spread (MAD) and, averaged over window bp, the largest excess and
+# deficit. A NUMT-like spike is a high maxLog2Ratio.
+def cohort_depth_outliers(mat,minDepth,window=50,blockSize=512):
+    numSamples = mat.shape[0]
+    res = {}
+    for k in ['medianDepth','meanDepth','fracBelowMin','log2RatioMAD','maxLog2Ratio','maxLog2RatioPos','minLog2Ratio']:
+        res[k] = np.zeros(numSamples,dtype=np.float64)
+    if numSamples == 0:
+        return res
+    # cohort profile of median-scaled depth
+    medians = np.zeros(numSamples,dtype=np.float64)
+    for start in range(0,numSamples,blockSize):
+        medians[start:start+blockSize] = np.median(mat[start:start+blockSize],axis=1)
+    scale = np.maximum(medians,1.0)
+    profile = np.zeros(mat.shape[1],dtype=np.float64)
+    for start in range(0,mat.shape[1],1024):
+        profile[start:start+1024] = np.median(mat[:,start:start+1024] / scale[:,None],axis=0)
+
+    for start in range(0,numSamples,blockSize):
+        block = np.asarray(mat[start:start+blockSize],dtype=np.float64)
+        ratio = np.log2((block + 1) / (scale[start:start+blockSize,None] * profile[None,:] + 1))
+        med = np.median(ratio,axis=1)
+        cs = np.cumsum(np.concatenate([np.zeros((ratio.shape[0],1)),ratio],axis=1),axis=1)
+        smooth = (cs[:,window:] - cs[:,:-window]) / window
+        res['medianDepth'][start:start+blockSize] = medians[start:start+blockSize]
+        res['meanDepth'][start:start+blockSize] = block.mean(axis=1)
+        res['fracBelowMin'][start:start+blockSize] = (block < minDepth).mean(axis=1)
+        res['log2RatioMAD'][start:start+blockSize] = np.median(np.abs(ratio - med[:,None]),axis=1)
+        res['maxLog2Ratio'][start:start+blockSize] = smooth.max(axis=1)
+        res['maxLog2RatioPos'][start:start+blockSize] = smooth.argmax(axis=1) + 1 + window // 2
+        res['minLog2Ratio'][start:start+blockSize] = smooth.min(axis=1)
+
+    # robust z of the spike and spread against the cohort, the larger of the two
+    zs = []
+    for k in ['maxLog2Ratio','log2RatioMAD']:
+        med = np.median(res[k])
+        mad = max(np.median(np.abs(res[k] - med)) * 1.4826,1e-6)
+        zs.append((res[k] - med) / mad)
+    res['outlierScore'] = np.maximum(zs[0],zs[1])
+    return res
+###############################################################################
@@ -0,0 +1,97 @@
+# cohort-depth.py
+
+# add samples to the cohort depth store and run QC queries over it
+
+
+import callmito_single
+import os
+import sys
+import argparse
+import numpy as np
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='cohort-depth.py')
+
+parser.add_argument('--store', type=str,help='cohort depth store dir, created on the first add',required=True)
+parser.add_argument('--finaldir', type=str,nargs='+',help='add the samples in these process-sample.py output dirs')
+parser.add_argument('--percentiles', type=str,help='write per position depth percentiles to this file')
+parser.add_argument('--percentileValues', type=float,nargs='+',help='percentiles to report',default=[5,25,50,75,95])
+parser.add_argument('--lowCoverage', type=str,help='write runs of positions with low cohort depth to this file')
+parser.add_argument('--lowCoveragePercentile', type=float,help='percentile of the cohort depth compared with --lowCoverageDepth',default=50)
+parser.add_argument('--lowCoverageDepth', type=float,help='positions below this depth are low coverage',default=10)
+parser.add_argument('--lowCoverageMinLen', type=int,help='report runs of at least this many positions',default=1)
+parser.add_argument('--outliers', type=str,help='write per sample depth profile outlier scores to this file')
+parser.add_argument('--minDepth', type=int,help='depth for the fraction of positions below it in --outliers',default=3)
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+storeDir = args.store
+if storeDir[-1] != '/':
+    storeDir += '/'
+
+if args.finaldir is not None:
+    numAdded = 0
+    known = set(callmito_single.read_cohort_samples(storeDir))
+    for finalDir in args.finaldir:
+        if finalDir[-1] != '/':
+            finalDir += '/'
+        if os.path.isdir(finalDir) is False:
+            print('Error! output dir %s not does not exist' % finalDir)
+            sys.exit(1)
+        for sampleName in sorted(os.listdir(finalDir)):
+            perBp = finalDir + sampleName + '/mitoMerge.per-bp.txt'
+            if os.path.isfile(perBp) is False:
+                continue
+            try:
+                callmito_single.append_cohort_depth(storeDir,sampleName,callmito_single.read_merged_depth(perBp))
+            except callmito_single.CallmitoError as e:
+                print('ERROR! %s' % e,flush=True)
+                sys.exit(1)
+            numAdded += 1
+            if sampleName in known:
+                print('replaced %s' % sampleName,flush=True)
+    print('added %i samples to %s' % (numAdded,storeDir))
+
+if os.path.isfile(storeDir + 'store.json') is False:
+    print('Error! %s is not a cohort depth store' % storeDir)
+    sys.exit(1)
+names,mat = callmito_single.open_cohort_depth(storeDir)
+print('store has %i samples x %i positions' % mat.shape,flush=True)
+
+pcts = None
+if args.percentiles is not None or args.lowCoverage is not None:
+    pctValues = sorted(set(args.percentileValues + [args.lowCoveragePercentile]))
+    pcts = callmito_single.cohort_depth_percentiles(mat,pctValues)
+
+if args.percentiles is not None:
+    outFile = open(args.percentiles,'w')
+    outFile.write('#pos\t' + '\t'.join(['p%g' % p for p in pctValues]) + '\n')
+    for i in range(mat.shape[1]):
+        outFile.write('%i\t%s\n' % (i+1,'\t'.join(['%.1f' % v for v in pcts[:,i]])))
+    outFile.close()
+
+if args.lowCoverage is not None:
+    values = pcts[pctValues.index(args.lowCoveragePercentile)]
+    runs = callmito_single.low_value_runs(values,args.lowCoverageDepth,args.lowCoverageMinLen)
+    outFile = open(args.lowCoverage,'w')
+    outFile.write('#start\tend\tlength\tminP%g\tmeanP%g\n' % (args.lowCoveragePercentile,args.lowCoveragePercentile))
+    for r in runs:
+        v = values[r[0]-1:r[1]]
+        outFile.write('%i\t%i\t%i\t%.1f\t%.1f\n' % (r[0],r[1],r[1]-r[0]+1,v.min(),v.mean()))
+    outFile.close()
+    print('%i low coverage runs' % len(runs))
+
+if args.outliers is not None:
+    res = callmito_single.cohort_depth_outliers(mat,args.minDepth)
+    cols = ['outlierScore','medianDepth','meanDepth','fracBelowMin','log2RatioMAD','maxLog2Ratio','maxLog2RatioPos','minLog2Ratio']
+    outFile = open(args.outliers,'w')
+    outFile.write('#sample\t' + '\t'.join(cols) + '\n')
+    for i in np.argsort(-res['outlierScore'],kind='stable'):
+        vals = ['%.4g' % res[c][i] for c in cols]
+        vals[cols.index('maxLog2RatioPos')] = '%i' % res['maxLog2RatioPos'][i]
+        outFile.write('%s\t%s\n' % (names[i],'\t'.join(vals)))
+    outFile.close()
@@ -0,0 +1,232 @@
+# compare-runs.py
+
+# run the current pipeline and an alternative (e.g. a faster engine) on the same
+# sample and compare their outputs with per-file tolerances
+
+
+import callmito_single
+import os
+import sys
+import argparse
+import shlex
+import subprocess
+import time
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='compare-runs.py')
+
+parser.add_argument('--outdir', type=str,help='dir for the runs, outputs go to OUTDIR/golden/ and OUTDIR/alt/',required=True)
+parser.add_argument('--name', type=str,help='name of sample',required=True)
+parser.add_argument('--processArgs', type=str,help='process-sample.py arguments common to both runs, without --finaldir and --name')
+parser.add_argument('--altArgs', type=str,help='extra process-sample.py arguments for the alternative run',default='')
+parser.add_argument('--skipRun', action='store_true',help='only compare existing outputs in OUTDIR/golden/ and OUTDIR/alt/')
+parser.add_argument('--depthAbsTol', type=int,help='allowed absolute depth difference per position',default=2)
+parser.add_argument('--depthRelTol', type=float,help='allowed relative depth difference per position',default=0.05)
+parser.add_argument('--afTol', type=float,help='allowed allele frequency difference for shared calls',default=0.1)
+parser.add_argument('--maxMaskDiffs', type=int,help='allowed positions masked to N in only one fasta',default=0)
+parser.add_argument('--minMitoDepth', type=int,help='depth masking cutoff for both runs, default is the minMitoDepth in each run log')
+parser.add_argument('--report', type=str,help='also write the report to this file')
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+outDir = args.outdir
+if outDir[-1] != '/':
+    outDir += '/'
+runDirs = {'golden':outDir + 'golden/','alt':outDir + 'alt/'}
+sampleDirs = {}
+for r in runDirs:
+    sampleDirs[r] = runDirs[r] + args.name + '/'
+
+wallTime = {}
+if args.skipRun is False:
+    if args.processArgs is None:
+        print('ERROR! --processArgs is required unless --skipRun is given')
+        sys.exit(1)
+    script = os.path.join(sys.path[0],'process-sample.py')
+    for r in runDirs:
+        if os.path.isdir(runDirs[r]) is False:
+            os.makedirs(runDirs[r])
+        cmd = '%s %s %s --finaldir %s --name %s' % (shlex.quote(sys.executable),shlex.quote(script),args.processArgs,runDirs[r],args.name)
+        if r == 'alt':
+            cmd += ' ' + args.altArgs
+        print(cmd,flush=True)
+        t = time.time()
+        try:
+            callmito_single.runCMD(cmd + ' > %s 2>&1' % (runDirs[r] + args.name + '.stdout'))
+        except callmito_single.CallmitoError:
+            print('ERROR! %s run failed, see %s' % (r,runDirs[r] + args.name + '.stdout'))
+            sys.exit(1)
+        wallTime[r] = time.time() - t
+
+#####################################################################
+# read outputs
+
+def read_depth(sampleDir):
+    depth = {}
+    inFile = open(sampleDir + 'mitoMerge.per-bp.txt','r')
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split()
+        depth[int(line[0])] = int(line[1])
+    inFile.close()
+    return depth
+
+def read_fasta(sampleDir,name):
+    return callmito_single.read_fasta_seq(sampleDir + name + '.fa')
+
+def read_haplogroup(sampleDir,name):
+    matches = []
+    inFile = open(sampleDir + name + '.haplogroup.txt','r')
+    for line in inFile:
+        line = line.rstrip()
+        if line.startswith('Best match:') or line.startswith('Tied match:'):
+            line = line.split('\t')
+            matches.append(line[1])
+    inFile.close()
+    matches.sort()
+    return matches
+
+# minMitoDepth from the input options in the run log, 3 if the log does not have it
+def read_min_mito_depth(sampleDir,name):
+    fileName = sampleDir + name + '.mito.log'
+    if os.path.isfile(fileName) is False:
+        return 3
+    inFile = open(fileName,'r')
+    for line in inFile:
+        line = line.rstrip()
+        line = line.split('\t')
+        if len(line) == 2 and line[0] == 'minMitoDepth':
+            inFile.close()
+            return int(line[1])
+    inFile.close()
+    return 3
+
+def read_stage_times(sampleDir,name):
+    times = {}
+    fileName = sampleDir + name + '.stage-times.txt'
+    if os.path.isfile(fileName) is False:
+        return times
+    inFile = open(fileName,'r')
+    for line in inFile:
+        if line[0] == '#':
+            continue
+        line = line.rstrip()
+        line = line.split('\t')
+        times[line[0]] = float(line[1])
+    inFile.close()
+    return times
+
+#####################################################################
+# compare
+
+report = []
+failures = []
+
+# depth
+gDepth = read_depth(sampleDirs['golden'])
+aDepth = read_depth(sampleDirs['alt'])
+if args.minMitoDepth is not None:
+    gMinDepth = args.minMitoDepth
+    aMinDepth = args.minMitoDepth
+else:
+    gMinDepth = read_min_mito_depth(sampleDirs['golden'],args.name)
+    aMinDepth = read_min_mito_depth(sampleDirs['alt'],args.name)
+outOfTol = 0
+maxDiff = 0
+maskFlips = 0
+for p in gDepth:
+    g = gDepth[p]
+    a = aDepth.get(p,0)
+    d = abs(g - a)
+    maxDiff = max(maxDiff,d)
+    if d > args.depthAbsTol and d > args.depthRelTol * max(g,a):
+        outOfTol += 1
+    if (g < gMinDepth) != (a < aMinDepth):  # make_fasta_germline masks depth < minMitoDepth
+        maskFlips += 1
+report.append('depth\tpositions\t%i' % len(gDepth))
+report.append('depth\tmeanGolden\t%.1f' % (sum(gDepth.values())/len(gDepth)))
+report.append('depth\tmeanAlt\t%.1f' % (sum(aDepth.values())/max(1,len(aDepth))))
+report.append('depth\tminMitoDepth\t%i\t%i' % (gMinDepth,aMinDepth))
+report.append('depth\tmaxAbsDiff\t%i' % maxDiff)
+report.append('depth\toutOfTolerance\t%i' % outOfTol)
+report.append('depth\tdepthMaskChanges\t%i' % maskFlips)
+if outOfTol > 0:
+    failures.append('depth')
+
+# germline calls
+gCalls = callmito_single.read_germline_calls(sampleDirs['golden'] + args.name + '.mitoMerged.germline.filter.vcf.gz')
+aCalls = callmito_single.read_germline_calls(sampleDirs['alt'] + args.name + '.mitoMerged.germline.filter.vcf.gz')
+shared = [k for k in gCalls if k in aCalls]
+onlyGolden = sorted([k for k in gCalls if k not in aCalls])
+onlyAlt = sorted([k for k in aCalls if k not in gCalls])
+afOut = [k for k in shared if abs(gCalls[k] - aCalls[k]) > args.afTol]
+report.append('vcf\tcallsGolden\t%i' % len(gCalls))
+report.append('vcf\tcallsAlt\t%i' % len(aCalls))
+report.append('vcf\tshared\t%i' % len(shared))
+report.append('vcf\tafOutOfTolerance\t%i' % len(afOut))
+for k in onlyGolden:
+    report.append('vcf\tonlyGolden\t%i-%s-%s' % k)
+for k in onlyAlt:
+    report.append('vcf\tonlyAlt\t%i-%s-%s' % k)
+for k in afOut:
+    report.append('vcf\tafDiff\t%i-%s-%s\t%.3f\t%.3f' % (k[0],k[1],k[2],gCalls[k],aCalls[k]))
+if len(onlyGolden) + len(onlyAlt) + len(afOut) > 0:
+    failures.append('vcf')
+
+# consensus
+gSeq = read_fasta(sampleDirs['golden'],args.name)
+aSeq = read_fasta(sampleDirs['alt'],args.name)
+baseDiffs = 0
+maskDiffs = 0
+for i in range(min(len(gSeq),len(aSeq))):
+    if gSeq[i] == aSeq[i]:
+        continue
+    if gSeq[i] == 'N' or aSeq[i] == 'N':
+        maskDiffs += 1
+    else:
+        baseDiffs += 1
+report.append('fasta\tlengthGolden\t%i' % len(gSeq))
+report.append('fasta\tlengthAlt\t%i' % len(aSeq))
+report.append('fasta\tbaseDiffs\t%i' % baseDiffs)
+report.append('fasta\tmaskDiffs\t%i' % maskDiffs)
+if len(gSeq) != len(aSeq) or baseDiffs > 0 or maskDiffs > args.maxMaskDiffs:
+    failures.append('fasta')
+
+# haplogroup
+gHap = read_haplogroup(sampleDirs['golden'],args.name)
+aHap = read_haplogroup(sampleDirs['alt'],args.name)
+report.append('haplogroup\tgolden\t%s' % ','.join(gHap))
+report.append('haplogroup\talt\t%s' % ','.join(aHap))
+if gHap != aHap:
+    failures.append('haplogroup')
+
+# speed
+gTimes = read_stage_times(sampleDirs['golden'],args.name)
+aTimes = read_stage_times(sampleDirs['alt'],args.name)
+for stage in gTimes:
+    if stage in aTimes and aTimes[stage] > 0:
+        report.append('speed\t%s\t%.1f\t%.1f\t%.2fx' % (stage,gTimes[stage],aTimes[stage],gTimes[stage]/aTimes[stage]))
+if len(gTimes) > 0 and len(aTimes) > 0:
+    report.append('speed\tallStages\t%.1f\t%.1f\t%.2fx' % (sum(gTimes.values()),sum(aTimes.values()),sum(gTimes.values())/max(sum(aTimes.values()),1e-9)))
+if 'golden' in wallTime:
+    report.append('speed\twallTime\t%.1f\t%.1f\t%.2fx' % (wallTime['golden'],wallTime['alt'],wallTime['golden']/max(wallTime['alt'],1e-9)))
+
+if len(failures) == 0:
+    report.append('result\tPASS')
+else:
+    report.append('result\tFAIL\t%s' % ','.join(failures))
+
+for r in report:
+    print(r)
+if args.report is not None:
+    outFile = open(args.report,'w')
+    for r in report:
+        outFile.write(r + '\n')
+    outFile.close()
+
+if len(failures) > 0:
+    sys.exit(1)
@@ -0,0 +1,48 @@
+# import-results.py
+
+# bulk load process-sample.py outputs into the sqlite results store, samples whose
+# outputs are unchanged since the last import are skipped
+
+
+import callmito_single
+import os
+import sys
+import argparse
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='import-results.py')
+
+parser.add_argument('--db', type=str,help='sqlite results store, created if it does not exist',required=True)
+parser.add_argument('--finaldir', type=str,nargs='+',help='output dirs given to process-sample.py, each sample is a subdir',required=True)
+parser.add_argument('--force', action='store_true',help='re-import samples even if their outputs are unchanged')
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+db = callmito_single.open_results_db(args.db)
+
+numUpdated = 0
+numUnchanged = 0
+for finalDir in args.finaldir:
+    if finalDir[-1] != '/':
+        finalDir += '/'
+    if os.path.isdir(finalDir) is False:
+        print('Error! output dir %s not does not exist' % finalDir)
+        sys.exit(1)
+    for sampleName in sorted(os.listdir(finalDir)):
+        sampleDir = finalDir + sampleName + '/'
+        # a sample dir has at least the depth or the haplogroup output
+        files = callmito_single.sample_result_files(sampleDir,sampleName)
+        if os.path.isfile(files['perBpStats']) is False and os.path.isfile(files['haplogroup']) is False:
+            continue
+        if callmito_single.import_sample_results(db,sampleDir,sampleName,args.force) is True:
+            print('imported %s' % sampleName,flush=True)
+            numUpdated += 1
+        else:
+            numUnchanged += 1
+
+db.close()
+print('%i samples imported, %i unchanged' % (numUpdated,numUnchanged))
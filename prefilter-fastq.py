@@ -0,0 +1,62 @@
+# prefilter-fastq.py
+
+# keep only reads from raw fastq that share k-mers with the mito reference, and
+# optionally with numts, before aligning them with bwa aln
+
+
+import callmito_single
+import os
+import sys
+import argparse
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='prefilter-fastq.py')
+
+parser.add_argument('--fastq', type=str,nargs='+',help='input fastq files, gzipped or plain',required=True)
+parser.add_argument('--out', type=str,help='output fastq.gz of candidate reads',required=True)
+parser.add_argument('--mitoFa',type=str,help='mito fasta',required=True)
+parser.add_argument('--mitoFaRotated',type=str,help='rotated mito fasta',required=True)
+parser.add_argument('--numtBed',type=str,help='also keep reads from these numt regions for competitive mapping, needs --ref')
+parser.add_argument('--ref', type=str,help='genome fasta with .fai for --numtBed')
+parser.add_argument('--kmerSize',type=int,help='k-mer size',default=20)
+parser.add_argument('--minKmers',type=int,help='keep reads with at least this many k-mers in the index',default=2)
+parser.add_argument('--threads',type=int,help='number of filtering processes',default=4)
+parser.add_argument('--chunkSize',type=int,help='reads per chunk sent to a filtering process',default=20000)
+parser.add_argument('--compressThreads',type=int,help='threads for bgzip compression',default=1)
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+myData = {} # dictionary for keeping and passing information
+
+myData['inFastqs'] = args.fastq
+myData['outFastq'] = args.out
+myData['mitoFa'] = args.mitoFa
+myData['mitoFaRotated'] = args.mitoFaRotated
+myData['numtBed'] = args.numtBed
+myData['ref'] = args.ref
+myData['kmerSize'] = args.kmerSize
+myData['minKmers'] = args.minKmers
+myData['threads'] = args.threads
+myData['chunkSize'] = args.chunkSize
+myData['compressionPolicy'] = 'full'
+myData['compressThreads'] = args.compressThreads
+callmito_single.set_compression_policy(myData)
+
+if myData['numtBed'] is not None and myData['ref'] is None:
+    print('Error! --numtBed needs --ref')
+    sys.exit(1)
+
+for fqFileName in myData['inFastqs']:
+    if os.path.isfile(fqFileName) is False:
+        print('Error! fastq %s does not exist' % fqFileName)
+        sys.exit(1)
+
+try:
+    callmito_single.prefilter_fastq(myData)
+except callmito_single.CallmitoError as e:
+    print('ERROR! %s' % e,flush=True)
+    sys.exit(1)
@@ -4,10 +4,8 @@
 
 
 import callmito_single
-import os
 import sys
 import argparse
-import time
 
 # SETUP
 
@@ -16,12 +14,33 @@ parser = argparse.ArgumentParser(description='process-sample.py')
 parser.add_argument('--ref', type=str,help='genome fasta with dictionary and .fai',required=True)
 parser.add_argument('--finaldir', type=str,help='final dir for output',required=True)
 parser.add_argument('--name', type=str,help='name of sample to process',required=True)
-parser.add_argument('--cram', type=str,help='aligned cram file',required=True)
+parser.add_argument('--cram', type=str,nargs='+',help='aligned cram files, one per library, as PATH or PATH:LIB',required=True)
 parser.add_argument('--coords',type=str,help='coordinates to extract, numts + chrM',required=True)
 parser.add_argument('--mitoFa',type=str,help='mito fasta with index',required=True)
 parser.add_argument('--mitoFaRotated',type=str,help='rotated mito fasta with index',required=True)
 parser.add_argument('--chainfile',type=str,help='liftover chain fail to convert rotated to original',required=True)
 parser.add_argument('--diagnosticTable',type=str,help='table of diagnostic SNPs',required=True)
+parser.add_argument('--callEngine',type=str,help='variant calling engine',choices=['mutect2','pileup'],default='mutect2')
+parser.add_argument('--minAlleleFreq',type=float,help='min read support for a germline call',default=0.5)
+parser.add_argument('--minMitoDepth',type=int,help='mask positions with lower depth in the fasta',default=3)
+parser.add_argument('--strandBiasMode',type=str,help='filter or ignore germline calls whose allele fails strand bias',choices=['filter','ignore'],default='filter')
+parser.add_argument('--preSubsample',action='store_true',help='subsample extracted reads before alignment when estimated depth is far above max coverage')
+parser.add_argument('--compression',type=str,help='compression of intermediate files, final outputs are always fully compressed',choices=['fast','none','full'],default='fast')
+parser.add_argument('--compressThreads',type=int,help='threads for bgzip and samtools compression',default=1)
+parser.add_argument('--retention',type=str,help='keep all intermediate files, or clean them up and keep the marked alignments as cram',choices=['keep','clean'],default='keep')
+parser.add_argument('--scratch',type=str,help='local scratch dir to work in, only final outputs are copied to finaldir')
+parser.add_argument('--profile',action='store_true',help='profile cpu and python memory of each stage, reports are written to the sample dir')
+parser.add_argument('--rotatedSubset',action='store_true',help='only align reads that can reach the kept windows to the rotated mito')
+parser.add_argument('--collapseDups',action='store_true',help='collapse reads with identical sequence before alignment')
+parser.add_argument('--shards',type=int,help='number of parallel Mutect2 shards per reference',default=1)
+parser.add_argument('--alignThreads',type=int,help='number of parallel bwa workers over the libraries and fastq shards',default=1)
+parser.add_argument('--alignShardReads',type=int,help='split each fastq into shards of this many reads for alignment, 0 does not split',default=0)
+parser.add_argument('--resultsDB',type=str,help='sqlite results store to add this sample to')
+parser.add_argument('--cohortDepth',type=str,help='cohort depth store dir to add this sample to')
+parser.add_argument('--benchmarkCaller',action='store_true',help='also run the other calling engine and report concordance')
+parser.add_argument('--qcMinReads',type=int,help='stop after extraction with fewer reads, 0 is no check',default=0)
+parser.add_argument('--qcMinBreadth',type=float,help='stop when less of the mito is expected, then found, at --minMitoDepth, 0 is no check',default=0.0)
+parser.add_argument('--qcMinMeanDepth',type=float,help='stop after coverage with a lower mean depth, 0 is no check',default=0.0)
 
 
 
@@ -29,115 +48,45 @@ args = parser.parse_args()
 
 #####################################################################
 
-myData = {} # dictionary for keeping and passing information
-
-myData['finalDir'] = args.finaldir
-myData['ref'] = args.ref
-myData['sampleName'] = args.name
-
-myData['cramFileName'] = args.cram
-myData['coordsFileName'] = args.coords
-
-myData['mitoFa'] = args.mitoFa
-myData['mitoFaRotated'] = args.mitoFaRotated
-
-
-myData['diagnosticTable'] = args.diagnosticTable
-
-
-
-myData['chainFile'] = args.chainfile
-
-# get sequence len
-inFile = open(myData['mitoFa'] + '.fai','r')
-line = inFile.readline()
-line = line.rstrip()
-line = line.split()
-l = int(line[1])
-myData['mitoLen'] = l
-inFile.close()
-
-myData['roteTake'] = 4000 # take 4000 first and last from the rotated
-myData['minAlleleFreq'] = 0.5 # require >= 50% read support
-
-# max coverage for downsampling
-myData['maxCoverage'] = 5000
-
-
-# check that have interval list file
-myData['mitoFaIntervalList'] = myData['mitoFa'].replace('.fa','.interval_list')
-myData['mitoFaRotatedIntervalList'] = myData['mitoFaRotated'].replace('.fa','.interval_list')
-
-if os.path.isfile(myData['mitoFaIntervalList']) is False:
-    print('ERROR! %s not found, please make interval list' % myData['mitoFaIntervalList'])
-    sys.exit()
-
-if os.path.isfile(myData['mitoFaRotatedIntervalList']) is False:
-    print('ERROR! %s not found, please make interval list' % myData['mitoFaIntervalList'])
-    sys.exit()
-
-
-
-if myData['finalDir'][-1] != '/':
-   myData['finalDir'] += '/'
-
-
-if os.path.isdir(myData['finalDir']) is False:
-    print('Error! output dir %s not does not exist' % myData['finalDir'])
-    sys.exit()
-    
-# setup the output dir
-myData['finalDirSample'] = myData['finalDir']  + myData['sampleName']
-
-if os.path.isdir(myData['finalDirSample']) is False:
-    print('making ',myData['finalDirSample'])
-    cmd = 'mkdir ' + myData['finalDirSample']
-    print(cmd)
-    callmito_single.runCMD(cmd)
-myData['finalDirSample'] += '/'    
-
-myData['logFileName'] = myData['finalDirSample'] + myData['sampleName'] + '.mito.log'
-myData['logFile'] = open(myData['logFileName'],'w')
-
-
-
-# add initial infoto log
-callmito_single.init_log(myData)
-callmito_single.check_prog_paths(myData)
-
-
-# get reads to extract
-callmito_single.extract_reads(myData)
-
-
-
-# align to each mito
-callmito_single.align_to_mitos(myData)
-
-
-
-
-callmito_single.run_coverage(myData)
-
-
-
-
-callmito_single.down_sample(myData)
-
-
-
-# run vcf
-callmito_single.call_vars(myData)
-
-
-# filter vcf
-callmito_single.filter_germline(myData)
-
-
-
-# make fasta and mask
-callmito_single.make_fasta_germline(myData)
-
-callmito_single.assign_haplogroup(myData)
-
-myData['logFile'].close()
\ No newline at end of file
+options = {} # run options, defaults of the others are in callmito_single.sampleDefaults
+
+options['finalDir'] = args.finaldir
+options['ref'] = args.ref
+options['sampleName'] = args.name
+
+options['cramFileName'] = args.cram
+options['coordsFileName'] = args.coords
+
+options['mitoFa'] = args.mitoFa
+options['mitoFaRotated'] = args.mitoFaRotated
+options['diagnosticTable'] = args.diagnosticTable
+options['chainFile'] = args.chainfile
+
+options['callEngine'] = args.callEngine
+options['minAlleleFreq'] = args.minAlleleFreq
+options['minMitoDepth'] = args.minMitoDepth
+options['strandBiasMode'] = args.strandBiasMode
+options['benchmarkCaller'] = args.benchmarkCaller
+options['callShards'] = args.shards
+options['alignThreads'] = args.alignThreads
+options['alignShardReads'] = args.alignShardReads
+options['preSubsample'] = args.preSubsample
+options['compressionPolicy'] = args.compression
+options['compressThreads'] = args.compressThreads
+options['retention'] = args.retention
+options['profile'] = args.profile
+options['rotatedSubset'] = args.rotatedSubset
+options['collapseDups'] = args.collapseDups
+options['resultsDB'] = args.resultsDB
+options['cohortDepth'] = args.cohortDepth
+options['scratchDir'] = args.scratch
+options['qcMinReads'] = args.qcMinReads
+options['qcMinBreadth'] = args.qcMinBreadth
+options['qcMinMeanDepth'] = args.qcMinMeanDepth
+
+try:
+    myData = callmito_single.setup_sample_run(options)
+    callmito_single.run_sample(myData)
+except callmito_single.CallmitoError as e:
+    print('ERROR! %s' % e,flush=True)
+    sys.exit(1)
@@ -0,0 +1,99 @@
+# recall-sample.py
+
+# remake germline calls, consensus and haplogroup from a saved allele count store
+
+
+import callmito_single
+import os
+import sys
+import argparse
+import time
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='recall-sample.py')
+
+parser.add_argument('--store', type=str,help='allele count store (.alleleCounts.npz) from process-sample.py',required=True)
+parser.add_argument('--finaldir', type=str,help='final dir for output',required=True)
+parser.add_argument('--name', type=str,help='name of sample, default is the name in the store')
+parser.add_argument('--mitoFa',type=str,help='mito fasta with index',required=True)
+parser.add_argument('--diagnosticTable',type=str,help='table of diagnostic SNPs',required=True)
+parser.add_argument('--minAlleleFreq',type=float,help='min read support for a germline call',default=0.5)
+parser.add_argument('--minMitoDepth',type=int,help='mask positions with lower depth in the fasta',default=3)
+parser.add_argument('--strandBiasMode',type=str,help='filter or ignore germline calls whose allele fails strand bias',choices=['filter','ignore'],default='filter')
+parser.add_argument('--pileupMinAltReads',type=int,help='min reads for an alt allele to be reported',default=2)
+parser.add_argument('--pileupMinAltFrac',type=float,help='min fraction of depth for an alt allele to be reported',default=0.03)
+parser.add_argument('--strandBiasMinDepth',type=int,help='min reads on each strand to test strand bias',default=5)
+parser.add_argument('--strandBiasMaxRatio',type=float,help='fail if allele freq on one strand is < this times the other',default=0.1)
+parser.add_argument('--allowEngineChange',action='store_true',help='re-call a store made with mutect2 calls using the pileup model')
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+myData = {} # dictionary for keeping and passing information
+
+myData['finalDir'] = args.finaldir
+myData['mitoFa'] = args.mitoFa
+myData['diagnosticTable'] = args.diagnosticTable
+if args.name is not None:
+    myData['sampleName'] = args.name
+
+myData['minAlleleFreq'] = args.minAlleleFreq
+myData['minMitoDepth'] = args.minMitoDepth
+myData['strandBiasMode'] = args.strandBiasMode
+myData['pileupMinAltReads'] = args.pileupMinAltReads
+myData['pileupMinAltFrac'] = args.pileupMinAltFrac
+myData['strandBiasMinDepth'] = args.strandBiasMinDepth
+myData['strandBiasMaxRatio'] = args.strandBiasMaxRatio
+myData['compressionPolicy'] = 'fast'
+myData['compressThreads'] = 1
+callmito_single.set_compression_policy(myData)
+
+callmito_single.load_allele_store(myData,args.store)
+
+# re-calling always uses the pileup model
+if myData['storeCallEngine'] == 'unknown':
+    print('WARNING! %s does not record the engine of the original calls, re-calling with the pileup model' % args.store)
+elif myData['storeCallEngine'] != 'pileup':
+    if args.allowEngineChange is False:
+        print('ERROR! %s was called with %s, re-calling uses the pileup model, add --allowEngineChange to do this anyway' % (args.store,myData['storeCallEngine']))
+        sys.exit(1)
+    print('WARNING! %s was called with %s, re-calling with the pileup model' % (args.store,myData['storeCallEngine']))
+
+
+if myData['finalDir'][-1] != '/':
+   myData['finalDir'] += '/'
+
+if os.path.isdir(myData['finalDir']) is False:
+    print('Error! output dir %s not does not exist' % myData['finalDir'])
+    sys.exit(1)
+
+# setup the output dir
+myData['finalDirSample'] = myData['finalDir']  + myData['sampleName']
+
+if os.path.isdir(myData['finalDirSample']) is False:
+    print('making ',myData['finalDirSample'])
+    cmd = 'mkdir ' + myData['finalDirSample']
+    print(cmd)
+    callmito_single.runCMD(cmd)
+myData['finalDirSample'] += '/'
+
+if os.path.isfile(myData['finalDirSample'] + 'mitoMerged.vcf.gz') is True:
+    print('Error! %s already has calls, please use a new output dir' % myData['finalDirSample'])
+    sys.exit(1)
+
+myData['logFileName'] = myData['finalDirSample'] + myData['sampleName'] + '.recall.log'
+myData['logFile'] = open(myData['logFileName'],'w')
+
+callmito_single.init_log(myData)
+
+try:
+    callmito_single.recall_from_store(myData)
+except callmito_single.CallmitoError as e:
+    print('ERROR! %s' % e,flush=True)
+    myData['logFile'].write('ERROR! %s\n' % e)
+    sys.exit(1)
+finally:
+    myData['logFile'].close()
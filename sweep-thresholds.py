@@ -0,0 +1,88 @@
+# sweep-thresholds.py
+
+# evaluate a grid of germline filtering thresholds over a cohort, each sample's merged
+# vcf and depth track are read once for the whole grid
+
+
+import callmito_single
+import os
+import sys
+import argparse
+import itertools
+import multiprocessing
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='sweep-thresholds.py')
+
+parser.add_argument('--finaldir', type=str,nargs='+',help='output dirs given to process-sample.py, each sample is a subdir',required=True)
+parser.add_argument('--diagnosticTable',type=str,help='table of diagnostic SNPs',required=True)
+parser.add_argument('--out', type=str,help='per sample and setting table',required=True)
+parser.add_argument('--summary', type=str,help='per setting cohort summary table',required=True)
+parser.add_argument('--minAlleleFreq',type=float,nargs='+',help='values of minAlleleFreq',default=[0.3,0.4,0.5,0.6,0.7,0.8,0.9])
+parser.add_argument('--minMitoDepth',type=int,nargs='+',help='values of minMitoDepth',default=[1,2,3,5,10,20])
+parser.add_argument('--strandBiasMode',type=str,nargs='+',help='strand bias modes',choices=['filter','ignore'],default=['filter','ignore'])
+parser.add_argument('--baseAlleleFreq',type=float,help='minAlleleFreq that haplogroup changes are compared to',default=0.5)
+parser.add_argument('--baseMitoDepth',type=int,help='minMitoDepth that haplogroup changes are compared to',default=3)
+parser.add_argument('--baseStrandBiasMode',type=str,help='strand bias mode that haplogroup changes are compared to',choices=['filter','ignore'],default='filter')
+parser.add_argument('--threads',type=int,help='number of samples processed in parallel',default=1)
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+grid = {'minAlleleFreq':sorted(set(args.minAlleleFreq + [args.baseAlleleFreq])),
+        'minMitoDepth':sorted(set(args.minMitoDepth + [args.baseMitoDepth])),
+        'strandBiasMode':sorted(set(args.strandBiasMode + [args.baseStrandBiasMode]))}
+base = (grid['minAlleleFreq'].index(args.baseAlleleFreq),grid['minMitoDepth'].index(args.baseMitoDepth),
+        grid['strandBiasMode'].index(args.baseStrandBiasMode))
+diag = callmito_single.read_diagnostic_table(args.diagnosticTable)
+
+samples = []
+for finalDir in args.finaldir:
+    if finalDir[-1] != '/':
+        finalDir += '/'
+    if os.path.isdir(finalDir) is False:
+        print('Error! output dir %s not does not exist' % finalDir)
+        sys.exit(1)
+    for sampleName in sorted(os.listdir(finalDir)):
+        sampleDir = finalDir + sampleName + '/'
+        if os.path.isfile(sampleDir + 'mitoMerged.vcf.gz') is False or os.path.isfile(sampleDir + 'mitoMerge.per-bp.txt') is False:
+            continue
+        samples.append([sampleName,sampleDir,grid,diag])
+print('sweeping %i settings over %i samples' % (len(grid['minAlleleFreq'])*len(grid['minMitoDepth'])*len(grid['strandBiasMode']),len(samples)),flush=True)
+
+settings = list(itertools.product(range(len(grid['minAlleleFreq'])),range(len(grid['minMitoDepth'])),range(len(grid['strandBiasMode']))))
+totCalls = {}
+totMasked = {}
+hapChanges = {}
+for k in settings:
+    totCalls[k] = 0
+    totMasked[k] = 0
+    hapChanges[k] = 0
+
+outFile = open(args.out,'w')
+outFile.write('#sample\tminAlleleFreq\tminMitoDepth\tstrandBiasMode\tcalls\tmaskedBases\thaplogroup\thaplogroupChanged\n')
+pool = multiprocessing.Pool(args.threads)
+for sampleName,res in pool.imap(callmito_single.sweep_sample_worker,samples):
+    baseHap = res['haplogroup'][base]
+    for k in settings:
+        changed = int(res['haplogroup'][k] != baseHap)
+        totCalls[k] += res['calls'][k]
+        totMasked[k] += res['maskedBases'][k]
+        hapChanges[k] += changed
+        outFile.write('%s\t%s\t%i\t%s\t%i\t%i\t%s\t%i\n' % (sampleName,grid['minAlleleFreq'][k[0]],grid['minMitoDepth'][k[1]],
+                      grid['strandBiasMode'][k[2]],res['calls'][k],res['maskedBases'][k],res['haplogroup'][k],changed))
+pool.close()
+pool.join()
+outFile.close()
+
+numSamples = max(1,len(samples))
+outFile = open(args.summary,'w')
+outFile.write('#minAlleleFreq\tminMitoDepth\tstrandBiasMode\tsamples\tmeanCalls\tmeanMaskedBases\thaplogroupChanges\n')
+for k in settings:
+    outFile.write('%s\t%i\t%s\t%i\t%.2f\t%.1f\t%i\n' % (grid['minAlleleFreq'][k[0]],grid['minMitoDepth'][k[1]],grid['strandBiasMode'][k[2]],
+                  len(samples),totCalls[k]/numSamples,totMasked[k]/numSamples,hapChanges[k]))
+outFile.close()
+print('wrote %s and %s' % (args.out,args.summary))
@@ -0,0 +1,95 @@
+# triage-sample.py
+
+# quick haplogroup from reads already aligned to the combined mito fasta, only the
+# diagnostic positions are genotyped
+
+
+import callmito_single
+import os
+import sys
+import argparse
+
+# SETUP
+
+parser = argparse.ArgumentParser(description='triage-sample.py')
+
+parser.add_argument('--finaldir', type=str,help='final dir for output',required=True)
+parser.add_argument('--name', type=str,help='name of sample to process',required=True)
+parser.add_argument('--cram', type=str,help='bam or cram aligned to the combined mito fasta, with index',required=True)
+parser.add_argument('--ref', type=str,help='combined mito fasta the cram was made with, required for cram input')
+parser.add_argument('--mitoFa',type=str,help='mito fasta with index',required=True)
+parser.add_argument('--mitoFaRotated',type=str,help='rotated mito fasta with index',required=True)
+parser.add_argument('--chainfile',type=str,help='liftover chain fail to convert rotated to original',required=True)
+parser.add_argument('--diagnosticTable',type=str,help='table of diagnostic SNPs',required=True)
+parser.add_argument('--minDepth',type=int,help='min reads to genotype a diagnostic site',default=1)
+parser.add_argument('--minAlleleFreq',type=float,help='min fraction of reads supporting the called base',default=0.5)
+parser.add_argument('--minBaseQ',type=int,help='min base quality',default=10)
+parser.add_argument('--minMapQ',type=int,help='min mapping quality, reads on the two copies in mito-both.fa have mapping quality 0',default=0)
+
+
+args = parser.parse_args()
+
+#####################################################################
+
+myData = {} # dictionary for keeping and passing information
+
+myData['finalDir'] = args.finaldir
+myData['sampleName'] = args.name
+myData['cramFileName'] = args.cram
+myData['pileupRef'] = args.ref
+myData['mitoFa'] = args.mitoFa
+myData['mitoFaRotated'] = args.mitoFaRotated
+myData['chainFile'] = args.chainfile
+myData['diagnosticTable'] = args.diagnosticTable
+myData['triageMinDepth'] = args.minDepth
+myData['minAlleleFreq'] = args.minAlleleFreq
+myData['pileupMinBaseQ'] = args.minBaseQ
+myData['pileupMinMapQ'] = args.minMapQ
+myData['roteTake'] = 4000 # take 4000 first and last from the rotated
+
+# get sequence len
+inFile = open(myData['mitoFa'] + '.fai','r')
+line = inFile.readline()
+line = line.rstrip()
+line = line.split()
+myData['mitoLen'] = int(line[1])
+myData['mitoContig'] = line[0]
+inFile.close()
+
+inFile = open(myData['mitoFaRotated'] + '.fai','r')
+line = inFile.readline()
+line = line.rstrip()
+line = line.split()
+myData['mitoRotatedContig'] = line[0]
+inFile.close()
+
+if myData['cramFileName'].endswith('.cram') is True and myData['pileupRef'] is None:
+    print('Error! --ref is required to read cram input %s' % myData['cramFileName'])
+    sys.exit(1)
+
+if myData['finalDir'][-1] != '/':
+   myData['finalDir'] += '/'
+
+if os.path.isdir(myData['finalDir']) is False:
+    print('Error! output dir %s not does not exist' % myData['finalDir'])
+    sys.exit(1)
+
+# setup the output dir
+myData['finalDirSample'] = myData['finalDir']  + myData['sampleName'] + '/'
+if os.path.isdir(myData['finalDirSample']) is False:
+    print('making ',myData['finalDirSample'])
+    os.mkdir(myData['finalDirSample'])
+
+myData['logFileName'] = myData['finalDirSample'] + myData['sampleName'] + '.triage.log'
+myData['logFile'] = open(myData['logFileName'],'w')
+
+callmito_single.init_log(myData)
+
+try:
+    callmito_single.triage_haplogroup(myData)
+except callmito_single.CallmitoError as e:
+    print('ERROR! %s' % e,flush=True)
+    myData['logFile'].write('ERROR! %s\n' % e)
+    sys.exit(1)
+finally:
+    myData['logFile'].close()